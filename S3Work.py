@@ -1,14 +1,233 @@
 import pandas as pd
 import botocore
+import botocore.config
 import boto3
-import os, io
-import json
-from typing import Union
+import os, io, tempfile, time, shutil, atexit
+import json, hashlib, threading, gzip
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Union, Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class LocalCache(object):
+    save_interval = 60
+
+    def __init__(self, directory:str, max_bytes:int=2*1024**3):
+        """
+        Content-addressed disk cache for S3 objects. Each file is stored under the hash of its bucket, key and ETag,
+        and the least recently used files are evicted once the cache grows over max_bytes. Objects bigger than
+        max_bytes are never cached. Access times of cache hits are written to the index at most every save_interval
+        seconds (and at exit), not on every hit.
+        directory: local folder where the cached files and the index are kept.
+        max_bytes: maximum size of the cache in bytes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.saved_at = time.time()
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        atexit.register(self.flush)
+
+    def get_path(self, bucket_name:str, key:str, etag:str) -> str:
+        digest = hashlib.sha256(f"{bucket_name}/{key}/{etag}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def lookup(self, bucket_name:str, key:str) -> Union[dict,None]:
+        """
+        Returns the cache entry ({'etag', 'path', 'size', 'last_access'}) of a key, or None if it isn't cached.
+        """
+        with self.lock:
+            entry = self.index.get(f"{bucket_name}/{key}")
+            if entry is not None and not os.path.exists(entry['path']):
+                del self.index[f"{bucket_name}/{key}"]
+                return None
+            return entry
+
+    def open(self, bucket_name:str, key:str, etag:str):
+        """
+        Opens the cached file of a key for reading and marks it as used, or returns None if that version isn't
+        cached anymore (eg: another thread evicted it after the lookup). The file is opened holding the lock, so it
+        stays readable even if it's evicted afterwards.
+        """
+        with self.lock:
+            entry = self.index.get(f"{bucket_name}/{key}")
+            if entry is None or entry['etag'] != etag:
+                return None
+            try:
+                f = open(entry['path'], 'rb')
+            except FileNotFoundError:
+                del self.index[f"{bucket_name}/{key}"]
+                return None
+            entry['last_access'] = time.time()
+            self.dirty = True
+            if time.time() - self.saved_at > self.save_interval:
+                self.save_index()
+            return f
+
+    def store(self, bucket_name:str, key:str, etag:str, chunks):
+        """
+        Writes the chunks of an object to the cache and returns the written file opened for reading.
+        Objects bigger than max_bytes are read from a temporary file that is deleted once closed, without being cached.
+        chunks: iterable of bytes, eg: the body of a get_object response.
+        """
+        path = self.get_path(bucket_name, key, etag)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+
+        if size > self.max_bytes:
+            f = tempfile.TemporaryFile(dir=self.directory)
+            with open(tmp_path, 'rb') as tmp:
+                shutil.copyfileobj(tmp, f)
+            os.remove(tmp_path)
+            f.seek(0)
+            return f
+
+        with self.lock:
+            os.replace(tmp_path, path)
+            f = open(path, 'rb')
+            old_entry = self.index.get(f"{bucket_name}/{key}")
+            if old_entry is not None and old_entry['path'] != path and os.path.exists(old_entry['path']):
+                os.remove(old_entry['path'])
+            self.index[f"{bucket_name}/{key}"] = {'etag': etag, 'path': path, 'size': size, 'last_access': time.time()}
+            self.evict(keep=f"{bucket_name}/{key}")
+            self.save_index()
+        return f
+
+    def evict(self, keep:str=None):
+        """
+        Removes the least recently used files until the cache fits in max_bytes. Must be called holding the lock.
+        keep: name ('bucket/key') of an entry that is never evicted, eg: the one just stored.
+        """
+        total = sum([i['size'] for i in self.index.values()])
+        for name, entry in sorted(self.index.items(), key=lambda i: i[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+            total -= entry['size']
+            del self.index[name]
+
+    def save_index(self):
+        """
+        Writes the index to disk. Must be called holding the lock.
+        """
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+        self.saved_at = time.time()
+
+    def flush(self):
+        """
+        Writes the access times not saved yet.
+        """
+        with self.lock:
+            if self.dirty:
+                self.save_index()
+
+class MultipartWriter(object):
+    def __init__(self, client, bucket_name:str, key:str, part_size:int=8*1024**2, max_workers:int=4):
+        """
+        Binary file-like object that uploads whatever is written to it as an S3 multipart upload.
+        Parts are uploaded in parallel as soon as part_size bytes are buffered, and at most max_workers parts are
+        in flight at any time, so the memory used is bounded by about (max_workers + 1) * part_size.
+        client: boto3 S3 client.
+        bucket_name: destination bucket.
+        key: destination key.
+        part_size: size in bytes of each part. S3 requires at least 5 MB for every part but the last one.
+        max_workers: number of parts uploaded in parallel.
+        """
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.buffer = io.BytesIO()
+        self.parts = []
+        self.pending = set()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+
+    def upload_part(self, number:int, data:bytes) -> dict:
+        response = self.client.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data)
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def collect(self, futures):
+        for future in futures:
+            self.parts.append(future.result())
+            self.pending.discard(future)
+
+    def flush_part(self):
+        if len(self.pending) >= self.max_workers:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            self.collect(done)
+        number = len(self.parts) + len(self.pending) + 1
+        self.pending.add(self.executor.submit(self.upload_part, number, self.buffer.getvalue()))
+        self.buffer = io.BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data:bytes) -> int:
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.part_size:
+            self.flush_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Uploads the last part and completes the upload. The upload is aborted if any part failed.
+        """
+        try:
+            if self.buffer.tell() > 0 or len(self.parts) + len(self.pending) == 0:
+                self.flush_part()
+            self.collect(list(self.pending))
+            self.client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                                  MultipartUpload={'Parts': sorted(self.parts, key=lambda i: i['PartNumber'])})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown()
+
+    def abort(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
 
 class S3Facilities(object):
-    def __init__(self, bucket_name:str, region_name:str):
+    def __init__(self, bucket_name:str, region_name:str, max_pool_connections:int=32, cache_dir:str=None, cache_max_bytes:int=2*1024**3):
+        """
+        bucket_name: default bucket for every operation.
+        region_name: AWS region. The AWS_DEFAULT_REGION environment variable takes precedence.
+        max_pool_connections: size of the HTTP connection pool shared by the threads of the bulk operations.
+        cache_dir: if set, files read with get_object are cached in this local folder and revalidated by ETag.
+        cache_max_bytes: maximum size of the local cache in bytes.
+        """
         print("Initializing AWS...")
         self.bucket_name = bucket_name
+        self.cache = LocalCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+        config = botocore.config.Config(max_pool_connections=max_pool_connections)
 
         region_name = os.environ.get('AWS_DEFAULT_REGION')
         aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
@@ -18,57 +237,129 @@ class S3Facilities(object):
             self.client = boto3.client('s3',
                 region_name=region_name,
                 aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key
+                aws_secret_access_key=aws_secret_access_key,
+                config=config
             )
             self.resource = boto3.resource('s3',
                 region_name=region_name,
                 aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key
+                aws_secret_access_key=aws_secret_access_key,
+                config=config
             )
         else:
             self.session = boto3.Session()
-            self.client = self.session.client('s3')
-            self.resource = self.session.resource('s3')
+            self.client = self.session.client('s3', config=config)
+            self.resource = self.session.resource('s3', config=config)
 
         self.ec2 = boto3.client('ec2', region_name=region_name)
         self.bucket = self.resource.Bucket(bucket_name)
 
         print("Connected successfully!")
 
-    def list_files(self, prefix:str='', endswith:str='', dont:str=None, get_objects:bool=False) -> list:
+    def iter_files(self, prefix:str='', endswith:str='', dont:Union[str,list]=None, start_after:str=None, modified_since=None, delimiter:str=None, page_size:int=1000) -> Iterator[dict]:
+        """
+        Lazily lists the files of the actual bucket, one page at a time. Yields the object summaries
+        returned by S3 (dicts with 'Key', 'LastModified', 'ETag', 'Size'...).
+        prefix: filter the files according to the name beginnning.
+        endswith: filter the files according to the name ending.
+        dont: remove files that have the string (or any of the strings of a list) you insert contained in the file name. With a delimiter, whole
+            folders containing it are not even listed.
+        start_after: only list keys that come after this one in lexicographical order. Filtered by S3 itself.
+        modified_since: only yield files modified after this datetime.
+        delimiter: if set (eg: '/'), the listing walks the folders one level at a time and skips the folders whose
+            keys all come before start_after.
+        page_size: number of keys requested per page.
+        """
+        if isinstance(dont, str):
+            dont = [dont]
+        params = {'Bucket': self.bucket_name, 'Prefix': prefix, 'PaginationConfig': {'PageSize': page_size}}
+        if start_after is not None:
+            params['StartAfter'] = start_after
+        if delimiter is not None:
+            params['Delimiter'] = delimiter
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**params):
+            for item in page.get('Contents', []):
+                if not item['Key'].endswith(endswith):
+                    continue
+                if dont != None and any([i in item['Key'] for i in dont]):
+                    continue
+                if modified_since is not None and item['LastModified'] <= modified_since:
+                    continue
+                yield item
+
+            for common_prefix in page.get('CommonPrefixes', []):
+                folder = common_prefix['Prefix']
+                if dont != None and any([i in folder for i in dont]):
+                    continue
+                if start_after is not None and folder < start_after and not start_after.startswith(folder):
+                    continue
+                yield from self.iter_files(folder, endswith, dont, start_after, modified_since, delimiter, page_size)
+
+    def list_prefixes(self, prefix:str='', delimiter:str='/') -> list:
+        """
+        List the folders right below a prefix.
+        prefix: parent folder (eg: 'used-cars-for-sale/full_data/').
+        delimiter: folder separator.
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        prefixes = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter=delimiter):
+            prefixes.extend([i['Prefix'] for i in page.get('CommonPrefixes', [])])
+        return prefixes
+
+    def list_files(self, prefix:str='', endswith:str='', dont:Union[str,list]=None, get_objects:bool=False, start_after:str=None, modified_since=None, delimiter:str=None) -> list:
         '''
         List files from the actual bucket.
         prefix: filter the files according to the name beginnning.
         endswith: filter the files according to the name ending.
-        dont: remove files that have the string you insert contained in the file name.
+        dont: remove files that have the string (or any of the strings of a list) you insert contained in the file name.
+        get_objects: if True, also returns the object summaries of the listed files.
+        start_after, modified_since, delimiter: see iter_files.
         '''
-        objects = self.bucket.objects.filter(Prefix=prefix)
-
-        keys = []
-        for item in objects:
-            if item.key.endswith(endswith):
-                if dont == None:
-                    keys.append(item.key)
-                elif dont not in item.key:
-                    keys.append(item.key)
+        objects = list(self.iter_files(prefix, endswith, dont, start_after, modified_since, delimiter))
+        keys = [i['Key'] for i in objects]
+
         if get_objects == True:
             return keys, objects
-        
+
         return keys
-    
-    def put_file(self, file:Union[str,list,dict,pd.DataFrame], key:str, sep:str=',', encoding_type:str="utf-8", index:bool=True):
+
+    def put_file(self, file:Union[str,list,dict,pd.DataFrame], key:str, sep:str=',', encoding_type:str="utf-8", index:bool=True, row_group_size:int=None,
+                 compression:str=None, chunksize:int=100000, part_size:int=8*1024**2, max_workers:int=4, if_match:str=None, if_none_match:str=None):
         """
         Upload file to AWS's actual bucket.
         file: upload data to S3 according to the type of input.
             Case:
                 str: consider the string as the directory of the file to upload.
                 list: consider it is a json data and convert it to json.
-                DataFrame: a csv file is built
+                DataFrame: a parquet file is built if the key ends with '.parquet', otherwise a csv file is built
         key: the Key that the file is about to receive inside AWS S3.
         sep: is a conditional input that is only used for DataFrames. It defines the csv file separator.
         encoding_type: type of encoding (eg: 'latin-1', 'utf-8', 'iso-891'...) in case of pd.DataFrame or JSON
         index: set if the DataFrame should have an index or don't.
+        row_group_size: only used for parquet files. Number of rows per row group, smaller groups allow finer predicate pushdown.
+        compression: only used for csv files. 'gzip' or 'zstd' (needs the zstandard package). Default is inferred from
+            the key ending ('.gz' or '.zst').
+        chunksize: only used for csv files. DataFrames with more rows than this, or compressed ones, are serialized
+            chunksize rows at a time and streamed as a multipart upload.
+        part_size: size in bytes of each part of the multipart upload.
+        max_workers: number of parts uploaded in parallel.
+        if_match: only for single request uploads. The upload fails with PreconditionFailed unless the current object
+            has this ETag (eg: the one returned by fetch_file), so a read-modify-write never replaces someone else's update.
+        if_none_match: only for single request uploads. '*' makes the upload fail if the object already exists.
+        Returns the ETag of the uploaded file for single request uploads.
         """
+        if compression is None and key.endswith('.gz'):
+            compression = 'gzip'
+        elif compression is None and key.endswith('.zst'):
+            compression = 'zstd'
+
+        if isinstance(file, pd.DataFrame) and not key.endswith('.parquet') and (compression is not None or len(file) > chunksize):
+            self.put_dataframe_multipart(file, key, sep, encoding_type, index, compression, chunksize, part_size, max_workers)
+            return
+
         if isinstance(file, str):
             with open(file, 'rb') as f:
                 file_obj = f.read()
@@ -76,13 +367,57 @@ class S3Facilities(object):
             json_data = json.dumps(file)
             encoded_data = json_data.encode(encoding_type)
             file_obj = io.BytesIO(encoded_data)
+        elif isinstance(file, pd.DataFrame) and key.endswith('.parquet'):
+            file_obj = io.BytesIO()
+            file.to_parquet(file_obj, index=index, row_group_size=row_group_size)
+            file_obj.seek(0)
         elif isinstance(file, pd.DataFrame):
             df_str = file.to_csv(sep=sep, index=index)
             encoded_data = df_str.encode(encoding_type)
             file_obj = io.BytesIO(encoded_data)
 
-        self.client.put_object(Body=file_obj, Bucket=self.bucket_name, Key=key)
-        print(f"File '{file_obj}' uploaded successfully to S3!")
+        conditions = {}
+        if if_match is not None:
+            conditions['IfMatch'] = if_match
+        if if_none_match is not None:
+            conditions['IfNoneMatch'] = if_none_match
+        response = self.client.put_object(Body=file_obj, Bucket=self.bucket_name, Key=key, **conditions)
+        print(f"File '{file if isinstance(file, str) else file_obj}' uploaded successfully to S3!")
+        return response['ETag']
+
+    def put_dataframe_multipart(self, df:pd.DataFrame, key:str, sep:str=',', encoding_type:str="utf-8", index:bool=True, compression:str=None,
+                                chunksize:int=100000, part_size:int=8*1024**2, max_workers:int=4):
+        """
+        Streams a DataFrame as a csv file to S3, chunksize rows at a time, through a parallel multipart upload.
+        Only one chunk of text and a few parts are kept in memory, whatever the size of the frame.
+        compression: None, 'gzip' or 'zstd'.
+        See put_file for the other arguments.
+        """
+        writer = MultipartWriter(self.client, self.bucket_name, key, part_size=part_size, max_workers=max_workers)
+        if compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=writer, mode='wb')
+        elif compression == 'zstd':
+            if zstandard is None:
+                writer.abort()
+                raise ImportError("zstd compression needs the 'zstandard' package.")
+            stream = zstandard.ZstdCompressor().stream_writer(writer, closefd=False)
+        elif compression is None:
+            stream = writer
+        else:
+            writer.abort()
+            raise ValueError(f"Unknown compression '{compression}'.")
+
+        try:
+            for start in range(0, max(len(df), 1), chunksize):
+                chunk = df.iloc[start:start + chunksize].to_csv(sep=sep, index=index, header=start == 0)
+                stream.write(chunk.encode(encoding_type))
+            if stream is not writer:
+                stream.close()
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+        print(f"File '{key}' uploaded successfully to S3!")
 
     def download_file(self, file_name:str, directory:str='', bucket_name:str=''):
         """
@@ -98,50 +433,192 @@ class S3Facilities(object):
             directory = f"/tmp/{file_name.split('/')[-1]}"
         self.client.download_file(bucket_name, file_name, directory)
 
-    def get_object(self, file_name:str, directory='', **kwargs):
+    def fetch_file(self, file_name:str, directory:str, bucket_name:str='', chunk_size:int=1024*1024, if_none_match:str=None) -> Union[str,None]:
         """
-        This method downloads the file but already returns it as a variable.
+        Downloads a file with a single request and returns its ETag, or None if it doesn't exist. Give the ETag to
+        put_file(if_match=...) to update the file only if nobody changed it since it was downloaded.
         file_name: file key.
-        directory: only used if get_object is True. Defines the directory for the file to be downloaded.
-        sep: if you already want to read a csv file and the separator is different of ',' you can set it here.
+        directory: local path the file is written to.
+        bucket_name: in case you need to download a file from a different bucket. Default is the actual bucket.
+        if_none_match: ETag of a copy already downloaded. If the file still has it, nothing is written and the same
+            ETag is returned.
         """
-        self.download_file(file_name, directory=directory)
+        if bucket_name == '':
+            bucket_name = self.bucket_name
+        params = {'Bucket': bucket_name, 'Key': file_name}
+        if if_none_match is not None:
+            params['IfNoneMatch'] = if_none_match
+        try:
+            response = self.client.get_object(**params)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
+                return None
+            if if_none_match is not None and e.response['Error']['Code'] in ("304", "NotModified"):
+                return if_none_match
+            raise
+
+        print(f"Downloading '{file_name}...'")
+        with open(directory, 'wb') as f:
+            for chunk in response['Body'].iter_chunks(chunk_size):
+                f.write(chunk)
+        return response['ETag']
+
+    def read_object(self, file_name:str, file_obj, encoding_type:str='utf-8', **kwargs):
+        """
+        Parses an already opened binary file object according to the key extension.
+        file_name: file key, only used to pick the parser.
+        file_obj: binary file-like object positioned at the beginning of the data.
+        encoding_type: encoding used for json and text files.
+        """
+        if file_name.endswith('.gz'):
+            file_obj = gzip.GzipFile(fileobj=file_obj, mode='rb')
+            file_name = file_name[:-len('.gz')]
+        elif file_name.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError("Reading zstd files needs the 'zstandard' package.")
+            file_obj = zstandard.ZstdDecompressor().stream_reader(file_obj)
+            file_name = file_name[:-len('.zst')]
+
         if file_name.endswith('.json'):
-            with open(f"/tmp/{file_name.split('/')[-1]}", 'r') as f:
-                return json.load(f)
+            return json.loads(file_obj.read().decode(encoding_type))
         elif file_name.endswith('.csv'):
-            return pd.read_csv(f"/tmp/{file_name.split('/')[-1]}", **kwargs)
-        elif file_name.endswith('.txt'):
-            with open(f"/tmp/{file_name.split('/')[-1]}", 'r') as f:
-                return f.read()
+            return pd.read_csv(file_obj, **kwargs)
+        elif file_name.endswith('.parquet'):
+            return pd.read_parquet(file_obj, **kwargs)
+        else:
+            return file_obj.read().decode(encoding_type)
+
+    def get_object(self, file_name:str, directory='', stream:bool=False, chunk_size:int=1024*1024, spill_threshold:int=None, encoding_type:str='utf-8', bucket_name:str='', **kwargs):
+        """
+        This method reads the file straight from S3 into memory and already returns it as a variable.
+        If the local cache is enabled, the cached copy is revalidated with a conditional request (If-None-Match)
+        and only downloaded again when its ETag changed.
+        file_name: file key.
+        directory: if set, the file is downloaded to this path and read from there instead of being kept in memory.
+        stream: if True, returns an iterator over the raw body in chunks of chunk_size bytes instead of the parsed file.
+        chunk_size: size in bytes of each chunk read from the body.
+        spill_threshold: if set, objects bigger than this number of bytes are spilled to a temporary file instead of memory.
+        encoding_type: encoding used for json and text files.
+        bucket_name: in case you need to read a file from a different bucket. Default is the actual bucket.
+        sep: if you already want to read a csv file and the separator is different of ',' you can set it here.
+        columns: only for parquet files. Reads only the listed columns.
+        filters: only for parquet files. Row group predicates (eg: [('Date', '>=', '2024-01-01')]) pushed down to the reader.
+        """
+        if bucket_name == '':
+            bucket_name = self.bucket_name
+        if directory != '':
+            self.download_file(file_name, directory=directory, bucket_name=bucket_name)
+            with open(directory, 'rb') as f:
+                return self.read_object(file_name, f, encoding_type=encoding_type, **kwargs)
+
+        params = {'Bucket': bucket_name, 'Key': file_name}
+        entry = None
+        if self.cache is not None and stream == False:
+            entry = self.cache.lookup(bucket_name, file_name)
+            if entry is not None:
+                params['IfNoneMatch'] = entry['etag']
+
+        try:
+            response = self.client.get_object(**params)
+        except botocore.exceptions.ClientError as e:
+            if entry is None or e.response['Error']['Code'] not in ("304", "NotModified"):
+                raise
+            f = self.cache.open(bucket_name, file_name, entry['etag'])
+            if f is not None:
+                print(f"Reading '{file_name}' from cache...")
+                with f:
+                    return self.read_object(file_name, f, encoding_type=encoding_type, **kwargs)
+            # Evicted since the lookup: download it again.
+            del params['IfNoneMatch']
+            response = self.client.get_object(**params)
+
+        print(f"Reading '{file_name}...'")
+        body = response['Body']
+        if stream == True:
+            return body.iter_chunks(chunk_size)
+
+        if self.cache is not None:
+            with self.cache.store(bucket_name, file_name, response['ETag'], body.iter_chunks(chunk_size)) as f:
+                return self.read_object(file_name, f, encoding_type=encoding_type, **kwargs)
+
+        if spill_threshold is None:
+            file_obj = io.BytesIO()
         else:
-            with open(f"/tmp/{file_name.split('/')[-1]}", 'r') as f:
-                return f.read()
-                
+            file_obj = tempfile.SpooledTemporaryFile(max_size=spill_threshold)
+        with file_obj:
+            for chunk in body.iter_chunks(chunk_size):
+                file_obj.write(chunk)
+            file_obj.seek(0)
+            return self.read_object(file_name, file_obj, encoding_type=encoding_type, **kwargs)
+
+    def get_object_with_retries(self, file_name:str, retries:int=3, backoff:float=0.5, **kwargs):
+        """
+        Same as get_object, but retries failed requests with exponential backoff. Missing keys are not retried.
+        retries: number of extra attempts after the first failure.
+        backoff: seconds to wait before the first retry, doubled at every new attempt.
+        """
+        for attempt in range(retries + 1):
+            try:
+                return self.get_object(file_name, **kwargs)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ("404", "NoSuchKey") or attempt == retries:
+                    raise
+            except Exception:
+                if attempt == retries:
+                    raise
+            time.sleep(backoff * 2 ** attempt)
+
+    def get_objects(self, keys:list, max_workers:int=16, retries:int=3, backoff:float=0.5, **kwargs) -> Iterator[tuple]:
+        """
+        Reads many files concurrently, sharing the pooled client between threads.
+        Yields (key, result, error) tuples as soon as each download finishes, so the order is not the order of keys.
+        When a key fails after every retry, result is None and error holds the exception.
+        keys: file keys.
+        max_workers: number of concurrent downloads. Keep it below the max_pool_connections used in the constructor.
+        retries: number of extra attempts for each key.
+        backoff: seconds to wait before the first retry, doubled at every new attempt.
+        kwargs: passed to get_object (eg: sep, columns...).
+        """
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(self.get_object_with_retries, key, retries, backoff, **kwargs): key for key in keys}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def file_exists(self, file_name:str, bucket_name:str='', get_object:bool=False, directory:str='', sep:str=',') -> Union[list,pd.DataFrame,bool]:
         """
         Check if file existis on AWS S3.
         file_name: file key.
         bucket_name: the bucket from where you want to download the file. Default is the actual bucket.
-        get_object: if True, downloads the file if it exists.
+        get_object: if True, downloads the file if it exists. This is done with a single (cache-aware) request.
         directory: only used if get_object is True. Defines the directory for the file to be downloaded.
         sep: if you already want to read a csv file and the separator is different of ',' you can set it here.
         """
         if bucket_name == '':
             bucket_name = self.bucket_name
+
+        if get_object == True:
+            kwargs = {'sep': sep} if file_name.endswith('.csv') else {}
+            try:
+                return self.get_object(file_name=file_name, directory=directory, bucket_name=bucket_name, **kwargs)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ("404", "NoSuchKey"):
+                    print(f"File {file_name} doesn't exists.")
+                    return []
+                raise
+
         try:
             self.resource.Object(bucket_name, file_name).load()
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == "404":
-                if get_object == True:
-                    print(f"File {file_name} doesn't exists.")
-                    return []
                 return False
-            
-        if get_object == True:
-            return self.get_object(file_name=file_name, directory=directory, sep=sep)
         return True
-    
+
     def delete_object(self, file_name:str, bucket_name:str=''):
         """
         Delete object from AWS S3.
@@ -190,8 +667,96 @@ class S3Facilities(object):
         if source_bucket == '':
             source_bucket = self.bucket_name
 
-        self.copy_object(old_key, new_key)
-        self.delete_object(old_key)
+        self.copy_object(old_key, new_key, source_bucket=source_bucket, destination_bucket=destination_bucket)
+        self.delete_object(old_key, bucket_name=source_bucket)
+
+    def delete_objects(self, keys:list, bucket_name:str='') -> dict:
+        """
+        Delete many objects from AWS S3, 1000 keys per request.
+        keys: file keys.
+        bucket_name: bucket where the files are located. Default is the actual bucket.
+        Returns a dict with the error message of every key that could not be deleted, and None for the deleted ones.
+        """
+        if bucket_name == '':
+            bucket_name = self.bucket_name
+
+        results = {}
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            response = self.client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': i} for i in batch], 'Quiet': True},
+            )
+            errors = {i['Key']: f"{i['Code']}: {i['Message']}" for i in response.get('Errors', [])}
+            for key in batch:
+                results[key] = errors.get(key)
+        return results
+
+    def copy_objects(self, keys:Union[list,dict], source_bucket:str='', destination_bucket:str='', max_workers:int=16, progress=None) -> dict:
+        """
+        Copies many objects concurrently. Copies are done by S3 itself, objects bigger than 8 MB are copied in parts.
+        keys: dict of {old_key: new_key}. A list of keys copies them to the same keys in the destination bucket.
+        source_bucket: actual files bucket.
+        destination_bucket: desired files bucket.
+        max_workers: number of concurrent copies.
+        progress: optional function called as progress(done, total) after each copy.
+        Returns a dict with the error message of every old key that could not be copied, and None for the copied ones.
+        """
+        if destination_bucket == '':
+            destination_bucket = self.bucket_name
+        if source_bucket == '':
+            source_bucket = self.bucket_name
+        if isinstance(keys, list):
+            keys = {i: i for i in keys}
+
+        def copy(old_key, new_key):
+            self.client.copy({'Bucket': source_bucket, 'Key': old_key}, destination_bucket, new_key)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(copy, old_key, new_key): old_key for old_key, new_key in keys.items()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    results[futures[future]] = None
+                except Exception as e:
+                    results[futures[future]] = str(e)
+                if progress is not None:
+                    progress(len(results), len(keys))
+        return results
+
+    def move_prefix(self, old_prefix:str, new_prefix:str, source_bucket:str='', destination_bucket:str='', max_workers:int=16, progress=None) -> dict:
+        """
+        Moves every file below a prefix to a new prefix: the files are copied concurrently and only the ones that
+        were copied successfully are deleted, in batches.
+        old_prefix: actual prefix (eg: 'used-cars-for-sale/full_data/localiza/').
+        new_prefix: desired prefix (eg: 'used-cars-for-sale/archive/localiza/').
+        source_bucket: actual files bucket.
+        destination_bucket: desired files bucket.
+        max_workers: number of concurrent copies.
+        progress: optional function called as progress(done, total) after each copy. Default prints the progress.
+        Returns a dict with the error message of every old key that could not be moved, and None for the moved ones.
+        Raises ValueError when both prefixes are in the same bucket and one of them starts with the other, as the
+        copies would land on (or below) the files being moved and the deletes would remove them.
+        """
+        if source_bucket == '':
+            source_bucket = self.bucket_name
+        if (destination_bucket if destination_bucket != '' else self.bucket_name) == source_bucket and \
+           (old_prefix.startswith(new_prefix) or new_prefix.startswith(old_prefix)):
+            raise ValueError(f"Can't move '{old_prefix}' to '{new_prefix}' in bucket '{source_bucket}': the prefixes overlap.")
+        if progress is None:
+            progress = lambda done, total: print(f"Copied {done}/{total} files.") if done % 100 == 0 or done == total else None
+
+        old_keys = [i['Key'] for i in self.iter_files(old_prefix)] if source_bucket == self.bucket_name else \
+                   [i.key for i in self.resource.Bucket(source_bucket).objects.filter(Prefix=old_prefix)]
+        keys = {i: new_prefix + i[len(old_prefix):] for i in old_keys}
+
+        results = self.copy_objects(keys, source_bucket, destination_bucket, max_workers, progress)
+        copied = [i for i in old_keys if results[i] is None]
+        for key, error in self.delete_objects(copied, bucket_name=source_bucket).items():
+            if error is not None:
+                results[key] = f"Copied but not deleted. {error}"
+        return results
 
     def stop_ec2(self, id:Union[str, list]):
         """
@@ -0,0 +1,43 @@
+"""
+Compares the price table extraction of a FIPE model page: BeautifulSoup + pd.read_html (the previous path of
+FipeScraper) against fipe_table.extract_prices. The default fixture is a synthetic page with the layout of a model
+page (filler brand and model lists and a generated price history), not a capture of the site; give the path of a
+saved page to time a real one.
+Run from the repository root:
+    python benchmarks/fipe_table_benchmark.py [page.html] [repetitions]
+"""
+import os, sys, timeit
+from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+from bs4 import BeautifulSoup
+from fipe_table import extract_prices
+from parsing import parse_currency
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'fipe_model_page_synthetic.html')
+
+def soup_read_html(html:bytes) -> list:
+    soup = BeautifulSoup(html, 'html.parser')
+    html_table = soup.find('table', {'style': 'width:100%'})
+    table = pd.read_html(StringIO(str(html_table)), header=0)[0]
+    return list(zip([i.lower() for i in table['Mês']], parse_currency(table['Valor']).tolist()))
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with open(path, 'rb') as f:
+        html = f.read()
+
+    expected = soup_read_html(html)
+    found = extract_prices(html)
+    if found != expected:
+        raise AssertionError(f"The extractors disagree: {len(found)} rows against {len(expected)}.")
+    print(f"{len(found)} months extracted from '{path}' ({len(html)/1024:.0f} KiB).")
+
+    results = {}
+    for name, function in [('BeautifulSoup + read_html', soup_read_html), ('lxml extract_prices', extract_prices)]:
+        results[name] = min(timeit.repeat(lambda: function(html), number=repetitions, repeat=3)) / repetitions
+        print(f"{name:<28}{results[name]*1000:8.2f} ms/page")
+    print(f"Speedup: {results['BeautifulSoup + read_html'] / results['lxml extract_prices']:.1f}x")
@@ -0,0 +1,46 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+OPTIONS_SCRIPT = """
+return Array.from(arguments[0].options).map(function (option) {
+    return {'text': option.text, 'value': option.value, 'html': option.innerHTML};
+});
+"""
+
+XPATH_SCRIPT = """
+var found = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var nodes = [];
+for (var i = 0; i < found.snapshotLength; i++) {
+    var node = found.snapshotItem(i);
+    nodes.push({'text': node.textContent, 'href': node.href || null, 'value': node.value === undefined ? null : node.value});
+}
+return nodes;
+"""
+
+def get_options(driver, select) -> list:
+    """
+    Every option of a select element in a single WebDriver call.
+    Returns [{'text': visible text, 'value': value, 'html': innerHTML}, ...] in the select order.
+    select: select WebElement.
+    """
+    return driver.execute_script(OPTIONS_SCRIPT, select)
+
+def wait_select(driver, xpath:str, timeout:int=10) -> tuple:
+    """
+    Waits for a select element and reads all its options at once.
+    Returns (select WebElement, options), options as returned by get_options.
+    """
+    element = WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, xpath)))
+    return element, get_options(driver, element)
+
+def find_all(driver, xpath:str, timeout:int=10) -> list:
+    """
+    Text, href and value of every node matching the xpath, read in a single WebDriver call per attempt.
+    Waits up to timeout seconds for at least one node, like presence_of_all_elements_located.
+    Returns [{'text': ..., 'href': ..., 'value': ...}, ...] in document order.
+    """
+    return WebDriverWait(driver, timeout).until(lambda d: d.execute_script(XPATH_SCRIPT, xpath) or False)
+
+def get_hrefs(driver, xpath:str, timeout:int=10) -> list:
+    return [i['href'] for i in find_all(driver, xpath, timeout)]
@@ -0,0 +1,289 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from S3Work import S3Facilities
+from parsing import apply_schema, assign_model_ids
+from cube import build_cube, CUBE_VERSION
+
+class Consolidator(object):
+    row_group_size = 10000
+    max_workers = 16
+    max_partitions = 4
+
+    def __init__(self, s3:S3Facilities, locadora:str, root:str='used-cars-for-sale/full_data'):
+        """
+        Incremental consolidation of the daily rental-company snapshots.
+        The consolidated history is stored as per-month partitions that are only ever appended to,
+        together with the matching partitions of the daily aggregate cube (see cube.build_cube),
+        and a small manifest keeps track of which dates were already ingested and of the stable integer id
+        given to every Model Info label. The files of a month are compacted into a single one once the month is
+        over or has more than max_partitions files (see compact), so reads cost a few requests per month.
+        s3: S3Facilities instance used for every read/write.
+        locadora: company name as used in the S3 keys (eg: 'localiza').
+        root: S3 prefix where the company folders live.
+        """
+        self.s3 = s3
+        self.locadora = locadora
+        self.root = f"{root}/{locadora}"
+        self.manifest_key = f"{self.root}/manifest.json"
+        self.legacy_key = f"{self.root}/{locadora}.csv"
+        self.partitions_prefix = f"{self.root}/partitions"
+        self.cube_prefix = f"{self.root}/cube"
+        self.obsolete = []
+        self.manifest = self.read_manifest()
+
+    def read_manifest(self) -> dict:
+        """
+        Reads the manifest from S3. On the first run the legacy consolidated csv, if any, is split into partitions,
+        and the cube of manifests written before the cube, the model ids or the current cube version (see
+        cube.CUBE_VERSION) existed is built once from their partitions.
+        """
+        manifest = self.s3.file_exists(self.manifest_key, get_object=True)
+        if isinstance(manifest, dict) and 'cube' in manifest and 'models' in manifest and manifest.get('cube_version') == CUBE_VERSION:
+            return manifest
+        if isinstance(manifest, dict):
+            self.manifest = manifest
+            old_cube = [key for keys in self.manifest.get('cube', {}).values() for key in keys]
+            self.manifest['cube'] = {}
+            self.manifest['cube_version'] = CUBE_VERSION
+            self.manifest.setdefault('models', {})
+            print(f"Building the aggregate cube of '{self.root}'...")
+            for month in sorted(self.manifest['partitions']):
+                month_df = pd.concat(self.read_partitions(self.manifest['partitions'][month]))
+                month_df = apply_schema(month_df.sort_index(kind='stable'))
+                self.write_cube(assign_model_ids(month_df, self.locadora, self.manifest['models']), month)
+            self.save_manifest()
+            new_cube = set([key for keys in self.manifest['cube'].values() for key in keys])
+            self.s3.delete_objects([i for i in old_cube if i not in new_cube])
+            return self.manifest
+
+        self.manifest = {'dates': [], 'partitions': {}, 'cube': {}, 'cube_version': CUBE_VERSION, 'models': {}}
+        if self.s3.file_exists(self.legacy_key):
+            print(f"Migrating '{self.legacy_key}' to monthly partitions...")
+            # Everything is read as text, so that the columns are typed by apply_schema just like the daily files.
+            legacy_df = apply_schema(self.s3.get_object(self.legacy_key, index_col=0, dtype=str))
+            self.write_partitions(legacy_df)
+            self.save_manifest()
+        return self.manifest
+
+    def save_manifest(self):
+        """
+        Uploads the manifest, then deletes the files replaced by compactions, which it no longer lists.
+        """
+        self.manifest['dates'] = sorted(self.manifest['dates'])
+        self.s3.put_file(self.manifest, self.manifest_key)
+        if len(self.obsolete) > 0:
+            self.s3.delete_objects(self.obsolete)
+            self.obsolete = []
+
+    def latest_date(self) -> str:
+        """
+        Last ingested date, or an empty string if nothing was ingested yet.
+        """
+        return self.manifest['dates'][-1] if len(self.manifest['dates']) > 0 else ''
+
+    @staticmethod
+    def get_date(key:str) -> str:
+        return key.split('/')[-1].split('.')[0]
+
+    @staticmethod
+    def get_month(this_date:str) -> str:
+        return pd.to_datetime(this_date).strftime('%Y-%m')
+
+    def new_files(self, keys:list) -> list:
+        """
+        Returns only the daily files whose date was not ingested yet.
+        keys: daily json keys of this company.
+        """
+        ingested = set(self.manifest['dates'])
+        return [i for i in keys if i != self.manifest_key and self.get_date(i) not in ingested]
+
+    def list_new_files(self) -> list:
+        """
+        Lists the daily files of this company stored after the last ingested one. The listing starts at the
+        cursor kept in the manifest and skips the partitions and cube folders, so it only walks the new keys.
+        """
+        keys = self.s3.list_files(f"{self.root}/", endswith='.json', dont=[self.partitions_prefix, self.cube_prefix],
+                                  start_after=self.manifest.get('last_key'), delimiter='/')
+        return self.new_files(keys)
+
+    def write_partitions(self, df:pd.DataFrame):
+        """
+        Appends a frame indexed by date to the monthly partitions. Existing partition files are never rewritten,
+        each call creates a new file per month named after the first and last dates it contains.
+        df: frame indexed by the snapshot date.
+        """
+        if df.empty:
+            return
+        df = apply_schema(df.sort_index(kind='stable'))
+        df = assign_model_ids(df, self.locadora, self.manifest['models'])
+        df.index.name = 'Date'
+        # The index has a date per listing, so only the distinct dates are parsed, all at once.
+        dates = df.index.unique()
+        months = df.index.map(dict(zip(dates, pd.to_datetime(dates).strftime('%Y-%m'))))
+        for month, month_df in df.groupby(months, sort=True):
+            dates = sorted(month_df.index.unique())
+            key = f"{self.partitions_prefix}/{month}/{dates[0]}_{dates[-1]}.parquet"
+            self.s3.put_file(month_df, key, row_group_size=self.row_group_size)
+
+            partition = self.manifest['partitions'].setdefault(month, [])
+            if key not in partition:
+                partition.append(key)
+            self.write_cube(month_df, month)
+
+            known = set(self.manifest['dates'])
+            self.manifest['dates'].extend([i for i in dates if i not in known])
+
+        months = sorted(self.manifest['partitions'])
+        for month in months:
+            count = len(self.manifest['partitions'][month])
+            if count > self.max_partitions or (month != months[-1] and count > 1):
+                self.compact(month)
+
+    def compact(self, month:str):
+        """
+        Rewrites the partitions and the cube of a month as a single file each. The replaced files are deleted by
+        the next save_manifest, once the manifest doesn't list them anymore.
+        month: month to compact (eg: '2024-05').
+        """
+        print(f"Compacting the partitions of {month}...")
+        old_keys = self.manifest['partitions'][month] + self.manifest['cube'].get(month, [])
+        month_df = apply_schema(pd.concat(self.read_partitions(self.manifest['partitions'][month])).sort_index(kind='stable'))
+        month_df = assign_model_ids(month_df, self.locadora, self.manifest['models'])
+        month_df.index.name = 'Date'
+
+        dates = sorted(month_df.index.unique())
+        key = f"{self.partitions_prefix}/{month}/{dates[0]}_{dates[-1]}.parquet"
+        self.s3.put_file(month_df, key, row_group_size=self.row_group_size)
+        self.manifest['partitions'][month] = [key]
+        self.manifest['cube'][month] = []
+        self.write_cube(month_df, month)
+
+        new_keys = self.manifest['partitions'][month] + self.manifest['cube'][month]
+        self.obsolete.extend([i for i in old_keys if i not in new_keys])
+
+    def write_cube(self, month_df:pd.DataFrame, month:str):
+        """
+        Writes the aggregate cube of a batch of days of a single month. As days never repeat between batches,
+        the cube files are append-only just like the partitions.
+        month_df: typed listings of the batch, indexed by date.
+        month: month of the batch (eg: '2024-05').
+        """
+        dates = sorted(month_df.index.unique())
+        key = f"{self.cube_prefix}/{month}/{dates[0]}_{dates[-1]}.parquet"
+        self.s3.put_file(build_cube(month_df), key)
+
+        cube = self.manifest['cube'].setdefault(month, [])
+        if key not in cube:
+            cube.append(key)
+
+    def ingest(self, keys:list) -> list:
+        """
+        Downloads only the new daily files, concurrently, and appends them to the monthly partitions.
+        Files that fail to download are left out of the manifest, so they are retried on the next ingest.
+        keys: daily json keys of this company.
+        Returns the list of ingested dates.
+        """
+        to_ingest = self.new_files(keys)
+        if len(to_ingest) == 0:
+            return []
+
+        frames = {}
+        for fn, data, error in self.s3.get_objects(to_ingest, max_workers=self.max_workers):
+            if error is not None:
+                print(f"Skipping '{fn}': {error}")
+                continue
+            this_df = pd.DataFrame(data)
+            this_df.index = [self.get_date(fn)]*len(this_df)
+            frames[fn] = this_df
+
+        if len(frames) == 0:
+            return []
+
+        self.write_partitions(pd.concat([frames[i] for i in sorted(frames)]))
+
+        # The listing cursor only moves up to the first failed key, so that failures are listed again.
+        for fn in sorted(to_ingest):
+            if fn not in frames:
+                break
+            if fn > self.manifest.get('last_key', ''):
+                self.manifest['last_key'] = fn
+        self.save_manifest()
+
+        return [self.get_date(i) for i in sorted(frames)]
+
+    def read_partition(self, key:str, columns:list=None, start:str=None, end:str=None) -> pd.DataFrame:
+        """
+        Reads a single partition file. Parquet partitions get the column projection and the date predicates pushed
+        down to the reader, csv partitions written before the parquet layout are filtered after reading.
+        """
+        if key.endswith('.parquet'):
+            filters = []
+            if start is not None:
+                filters.append(('Date', '>=', start))
+            if end is not None:
+                filters.append(('Date', '<=', end))
+            return self.s3.get_object(key, columns=columns, filters=filters if len(filters) > 0 else None)
+
+        df = self.s3.get_object(key, index_col=0, dtype=str)
+        df.index.name = 'Date'
+        if columns is not None:
+            df = df[columns]
+        if start is not None:
+            df = df[df.index >= start]
+        if end is not None:
+            df = df[df.index <= end]
+        return df
+
+    def month_keys(self, files:dict, start:str=None, end:str=None) -> list:
+        """
+        Keys of the months between the months of start and end, in month order.
+        files: {month: keys} dictionary of the manifest (partitions or cube).
+        """
+        first = self.get_month(start) if start is not None else ''
+        last = self.get_month(end) if end is not None else '9999-12'
+        return [key for month in sorted(files) if first <= month <= last for key in files[month]]
+
+    def read_partitions(self, keys:list, columns:list=None, start:str=None, end:str=None) -> list:
+        """
+        Reads many partition files concurrently (see read_partition), in the order of keys.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda key: self.read_partition(key, columns=columns, start=start, end=end), keys))
+
+    def load(self, columns:list=None, start:str=None, end:str=None) -> pd.DataFrame:
+        """
+        Reads the partitions listed in the manifest into a single typed frame indexed by date.
+        columns: only read these columns. Default reads every column.
+        start: first date to read (eg: '2024-01-01'). Partitions of earlier months are not even downloaded.
+        end: last date to read. Partitions of later months are not even downloaded.
+        """
+        keys = self.month_keys(self.manifest['partitions'], start, end)
+
+        frames = self.read_partitions(keys, columns=columns, start=start, end=end)
+        if len(frames) == 0:
+            return pd.DataFrame()
+        # Partitions have their own categories, so the concatenation is typed again as a whole.
+        return apply_schema(pd.concat(frames).sort_index(kind='stable'))
+
+    def load_cube(self, start:str=None, end:str=None) -> pd.DataFrame:
+        """
+        Reads the daily aggregate cube into a single frame indexed by date, one row per (date, Model ID).
+        start: first date to read (eg: '2024-01-01').
+        end: last date to read.
+        """
+        keys = self.month_keys(self.manifest['cube'], start, end)
+
+        frames = {}
+        for key, data, error in self.s3.get_objects(keys, max_workers=self.max_workers):
+            if error is not None:
+                raise error
+            frames[key] = data
+
+        if len(frames) == 0:
+            return pd.DataFrame()
+        cube = apply_schema(pd.concat([frames[i] for i in keys]).sort_index(kind='stable'))
+        if start is not None:
+            cube = cube[cube.index >= start]
+        if end is not None:
+            cube = cube[cube.index <= end]
+        return cube
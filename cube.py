@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Bumped whenever the cube columns change, so cubes written by an older version are built again.
+CUBE_VERSION = 2
+DIMENSIONS = ['Model Info', 'Brand', 'Model', 'Specification', 'Year']
+
+def build_cube(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates typed listings into one row per (Date, Model ID) with the number of sales, the median and last
+    prices of the day and the sorted list of the day prices ('Prices'), so medians over any window stay exact.
+    Days are independent from each other, so the cube of a batch of new days never changes the cube of older ones.
+    df: typed listings frame indexed by date, with the 'Model ID' and 'Model Info' columns (see parsing.assign_model_ids).
+    """
+    df = df.rename_axis('Date')
+    grouped = df.groupby(['Date', 'Model ID'], sort=True, observed=True)
+
+    cube = grouped['Price'].agg(**{'Sales': 'count', 'Median Price': 'median', 'Last Price': 'last'})
+    prices = day_prices(df).reindex(cube.index)
+    dimensions = grouped[[i for i in DIMENSIONS if i in df.columns]].first()
+
+    cube = pd.concat([dimensions, cube, prices], axis=1).reset_index(level='Model ID')
+    cube['Model Info'] = cube['Model Info'].astype('category')
+    return cube
+
+def day_prices(df:pd.DataFrame) -> pd.Series:
+    """
+    Sorted array of the prices of every (Date, Model ID), without the missing prices. The listings are sorted once
+    and cut at the group boundaries, instead of building a list per group.
+    df: typed listings frame indexed by 'Date', with the 'Model ID' column.
+    """
+    priced = df.loc[df['Price'].notna(), ['Model ID', 'Price']].reset_index()
+    priced = priced.sort_values(['Date', 'Model ID', 'Price'], kind='stable')
+    dates, ids, values = priced['Date'].values, priced['Model ID'].values, priced['Price'].values.astype('float64')
+
+    starts = np.flatnonzero(np.r_[True, (dates[1:] != dates[:-1]) | (ids[1:] != ids[:-1])]) if len(priced) > 0 else np.array([], dtype=int)
+    index = pd.MultiIndex.from_arrays([dates[starts], ids[starts]], names=['Date', 'Model ID'])
+    return pd.Series(np.split(values, starts[1:]) if len(starts) > 0 else [], index=index, dtype='object', name='Prices')
+
+def window_median(cube:pd.DataFrame) -> pd.Series:
+    """
+    Median price per Model ID over every day of a cube window, computed from the exact prices of the days.
+    cube: rows of the cube for the wanted window.
+    """
+    cube = cube[cube['Sales'] > 0]
+    if cube.empty:
+        return pd.Series(dtype='float64')
+    # Sales counts the prices that aren't missing, so it is the length of every Prices array.
+    prices = np.concatenate(cube['Prices'].values).astype('float64')
+    ids = np.repeat(cube['Model ID'].values, cube['Sales'].values)
+    return pd.Series(prices).groupby(ids).median().rename_axis('Model ID')
+
+def summarize(cube:pd.DataFrame) -> pd.DataFrame:
+    """
+    Sales, median and last prices per Model ID over a cube window, as used by the ranking.
+    cube: rows of the cube for the wanted window, sorted by date.
+    """
+    grouped = cube.groupby('Model ID')
+    summary = pd.DataFrame()
+    summary['Model Info'] = grouped['Model Info'].first()
+    summary['Sales'] = grouped['Sales'].sum()
+    summary['Median Prices'] = window_median(cube)
+    summary['Last Prices'] = grouped['Last Price'].last()
+    return summary
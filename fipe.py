@@ -1,4 +1,5 @@
-import os, time
+import os, time, queue, socket, shutil, tempfile, threading, weakref
+from concurrent.futures import ThreadPoolExecutor
 import boto3, botocore
 import pandas as pd
 import textdistance
@@ -13,22 +14,42 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
+from fipe_api import FipeApiClient
+from bulk_dom import wait_select
 
-class FipeScraper(object):
-    def __init__(self, timeout=3):
-        self.page_count = 1
+class DriverPool(object):
+    def __init__(self, size:int=4, max_uses:int=200, warm_up=None, timeout:int=300):
+        """
+        Pool of headless Chrome drivers that can run at the same time: every driver has its own user data directory
+        and remote debugging port. Drivers are created lazily, warmed up once, reused between searches, checked before
+        being handed out and recycled after max_uses searches or when they stop answering.
+        size: maximum number of drivers alive at once.
+        max_uses: number of times a driver is released before it is replaced by a new one.
+        warm_up: function called with every new driver (eg: to open the consultation page).
+        timeout: seconds acquire() waits for a driver when all of them are busy.
+        """
+        self.size = size
+        self.max_uses = max_uses
+        self.warm_up = warm_up
         self.timeout = timeout
-        self.url = 'https://veiculos.fipe.org.br/'
-        self.soup = None
-        self.setUp()
-        self.get()
-        self.open_consulta()
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.alive = 0
+        self.profiles = {}
+        self.uses = {}
+
+    @staticmethod
+    def free_port() -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
 
-    def setUp(self):
-        '''Setting up selenium driver. This functions has an extra chrome option for setting the default download directory to the /tmp/ path.'''
+    def new_driver(self) -> webdriver.Chrome:
+        '''Setting up a selenium driver with its own profile and debugging port, so many of them can run at once.'''
         caps = DesiredCapabilities.CHROME.copy()
         caps["pageLoadStrategy"] = "normal"
-        
+
+        profile = tempfile.mkdtemp(prefix='chrome-user-data-')
         options = Options()
         options.add_argument('--disable-blink-features=AutomationControlled')
 
@@ -37,18 +58,129 @@ class FipeScraper(object):
         options.add_argument('--disable-gpu')
         options.add_argument('--disable-dev-shm-usage')
         options.add_argument('--disable-dev-tools')
-        options.add_argument('--remote-debugging-port=9222')
+        options.add_argument(f'--remote-debugging-port={self.free_port()}')
         options.add_argument('--window-size=1280x1696')
-        options.add_argument('--user-data-dir=/tmp/chrome-user-data')
-        options.add_argument('--single-process')
+        options.add_argument(f'--user-data-dir={profile}')
         options.add_argument("--no-zygote")
         options.add_argument('--ignore-certificate-errors')
 
         # options.binary_location = os.environ['CHROME_BINARY_PATH']      
 
         # service = Service(executable_path=os.environ['CHROME_DRIVER_PATH'])
-        # self.driver = webdriver.Chrome(service=service, options=options)
-        self.driver = webdriver.Chrome(options=options)
+        # driver = webdriver.Chrome(service=service, options=options)
+        try:
+            driver = webdriver.Chrome(options=options)
+            if self.warm_up is not None:
+                self.warm_up(driver)
+        except Exception:
+            if 'driver' in locals():
+                driver.quit()
+            shutil.rmtree(profile, ignore_errors=True)
+            raise
+        self.profiles[id(driver)] = profile
+        self.uses[id(driver)] = 0
+        return driver
+
+    def is_healthy(self, driver:webdriver.Chrome) -> bool:
+        try:
+            return len(driver.window_handles) > 0 and driver.execute_script('return document.readyState') == 'complete'
+        except Exception:
+            return False
+
+    def discard(self, driver:webdriver.Chrome):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        shutil.rmtree(self.profiles.pop(id(driver), ''), ignore_errors=True)
+        self.uses.pop(id(driver), None)
+        with self.lock:
+            self.alive -= 1
+
+    def acquire(self) -> webdriver.Chrome:
+        """
+        Hands out a healthy idle driver, or a new one while the pool isn't full. Otherwise waits for a release.
+        """
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    create = self.alive < self.size
+                    if create:
+                        self.alive += 1
+                if create:
+                    try:
+                        return self.new_driver()
+                    except Exception:
+                        with self.lock:
+                            self.alive -= 1
+                        raise
+                driver = self.idle.get(timeout=self.timeout)
+
+            if self.is_healthy(driver):
+                return driver
+            print('Recycling an unresponsive driver...')
+            self.discard(driver)
+
+    def release(self, driver:webdriver.Chrome, healthy:bool=True):
+        """
+        Gives a driver back to the pool. Drivers that failed or were used max_uses times are replaced.
+        """
+        self.uses[id(driver)] = self.uses.get(id(driver), 0) + 1
+        if not healthy or self.uses[id(driver)] >= self.max_uses:
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+class FipeScraper(object):
+    def __init__(self, timeout=3, pool:DriverPool=None, workers:int=1, api:FipeApiClient=None, keep_open:bool=False):
+        """
+        Scraper of the FIPE consultation page. Each working thread drives its own browser, taken from the pool.
+        The browsers of a pool created by the scraper are closed at the end of every search_price, unless keep_open
+        is set or the scraper is used in a with block, which keeps them open for the next searches until close()
+        or the end of the block.
+        timeout: kept for compatibility.
+        pool: DriverPool shared between scrapers, closed by its owner. Drivers of a pool without warm_up are warmed
+            up by the scraper the first time it takes them. Default creates a pool of `workers` drivers owned by this scraper.
+        workers: number of browsers search_price spreads the rows across.
+        api: FipeApiClient used by search_price(engine='api'). Default creates one searching `workers` rows at once.
+        keep_open: if True, the browsers of the own pool are reused between searches and only closed by close().
+        """
+        self.page_count = 1
+        self.timeout = timeout
+        self.url = 'https://veiculos.fipe.org.br/'
+        self.soup = None
+        self.workers = workers
+        self.keep_open = keep_open
+        self.own_pool = pool is None
+        self.pool = pool if pool is not None else DriverPool(size=workers, warm_up=self.warm_up)
+        self.warmed = weakref.WeakSet()
+        self.local = threading.local()
+        self.api = api if api is not None else FipeApiClient(max_workers=workers)
+
+    def __enter__(self):
+        self.keep_open = True
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def driver(self) -> webdriver.Chrome:
+        return getattr(self.local, 'driver', None)
+
+    def warm_up(self, driver:webdriver.Chrome):
+        self.local.driver = driver
+        self.get()
+        self.open_consulta()
 
     def formatar_data(self, mes, ano):
         nomes_meses = {
@@ -92,27 +224,26 @@ class FipeScraper(object):
         ativar_seletor.select_by_visible_text(self.formatar_data(int(mes), ano))
 
     def set_marca(self, marca:str):
-        
-        selector = Select(WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.XPATH, "//select[@id='selectMarcacarro']"))))
-        option_to_select = [i.get_attribute('innerHTML') for i in selector.options if marca.lower() in unidecode(i.get_attribute('innerHTML').lower())]
-        selector.select_by_visible_text(option_to_select[0])
+        select, options = wait_select(self.driver, "//select[@id='selectMarcacarro']")
+        option_to_select = [i['text'] for i in options if marca.lower() in unidecode(i['text'].lower())]
+        Select(select).select_by_visible_text(option_to_select[0])
 
     def set_modelo(self, modelo:str):
-        selector = Select(WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.XPATH, "//select[@id='selectAnoModelocarro']"))))
+        select, options = wait_select(self.driver, "//select[@id='selectAnoModelocarro']")
         min_value = np.inf
 
-        for opt in selector.options:
-            score = textdistance.levenshtein(modelo.lower(), unidecode(opt.get_attribute('innerHTML').lower()))
+        for opt in options:
+            score = textdistance.levenshtein(modelo.lower(), unidecode(opt['text'].lower()))
             if score < min_value:
-                option_to_select = opt.get_attribute('innerHTML')
+                option_to_select = opt['text']
                 min_value = score
-        selector.select_by_visible_text(option_to_select)
+        Select(select).select_by_visible_text(option_to_select)
 
     def set_ano(self, ano:str):
-        selector = Select(WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.XPATH, "//select[@id='selectAnocarro']"))))
-        self.driver.execute_script("arguments[0].click();", selector)
-        option_to_select = [i.get_attribute('innerHTML') for i in selector.options if ano in i.get_attribute('innerHTML') and 'diesel' not in i.get_attribute('innerHTML').lower()]
-        selector.select_by_visible_text(option_to_select[0])
+        select, options = wait_select(self.driver, "//select[@id='selectAnocarro']")
+        self.driver.execute_script("arguments[0].click();", select)
+        option_to_select = [i['text'] for i in options if ano in i['text'] and 'diesel' not in i['text'].lower()]
+        Select(select).select_by_visible_text(option_to_select[0])
 
     def search(self):
         search_button = WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//div[@class='button pesquisa']/a[@id='buttonPesquisarcarro']")))
@@ -130,18 +261,84 @@ class FipeScraper(object):
 
         return df
 
-    def search_price(self, df_selected:pd.DataFrame, month, year):
+    def search_row(self, row, month, year) -> pd.Series:
+        self.set_mes_referencia(month, year)
+        self.set_marca(row['Brand'])
+        self.set_modelo(row['Model'])
+        self.set_ano(row['Year'].split('/')[0])
+        self.search()
+        return self.get_table().loc['Preço Médio']
+
+    def acquire(self) -> webdriver.Chrome:
+        '''
+        Takes a driver from the pool, opening the consultation page on the ones a pool without warm_up hands out for the first time.
+        '''
+        driver = self.pool.acquire()
+        if self.pool.warm_up is None and driver not in self.warmed:
+            try:
+                self.warm_up(driver)
+            except Exception:
+                self.pool.release(driver, healthy=False)
+                raise
+            self.warmed.add(driver)
+        return driver
+
+    def search_rows(self, rows:list, month, year, retries:int=1) -> dict:
+        '''
+        Searches some (index, row) pairs with a single browser of the pool. A row that fails is tried again on a new browser.
+        '''
+        results = {}
+        driver = self.acquire()
+        try:
+            for i, row in rows:
+                for attempt in range(retries + 1):
+                    self.local.driver = driver
+                    try:
+                        results[i] = self.search_row(row, month, year)
+                        break
+                    except Exception as e:
+                        self.pool.release(driver, healthy=False)
+                        driver = None
+                        if attempt == retries:
+                            raise
+                        print(f"Retrying '{row['Model Info']}' after: {e}")
+                        driver = self.acquire()
+        finally:
+            if driver is not None:
+                self.pool.release(driver)
+            self.local.driver = None
+        return results
+
+    def search_price(self, df_selected:pd.DataFrame, month, year, engine:str='browser'):
+        '''
+        Average FIPE price of the selected rows, one column per 'Model Info'.
+        engine: 'browser' drives the consultation page with the pool browsers, 'api' posts the page forms directly (see fipe_api).
+        '''
+        if engine == 'api':
+            return self.api.search_price(df_selected, month, year)
+        if engine != 'browser':
+            raise ValueError(f"Unknown engine '{engine}', use 'browser' or 'api'.")
+
+        rows = list(df_selected.iterrows())
+        workers = max(min(self.workers, len(rows)), 1)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.search_rows, rows[i::workers], month, year) for i in range(workers)]
+                results = {}
+                for future in futures:
+                    results.update(future.result())
+        finally:
+            if not self.keep_open:
+                self.close()
+
         final_df = {}
-        for i, row in df_selected.iterrows():
-            sel = row['Model Info']
-            self.set_mes_referencia(month, year)
-            self.set_marca(row['Brand'])
-            self.set_modelo(row['Model'])
-            self.set_ano(row['Year'].split('/')[0])
-            self.search()
-            df = self.get_table().loc['Preço Médio']
-            final_df[sel] = df
-
-        self.driver.close()
+        for i, row in rows:
+            final_df[row['Model Info']] = results[i]
         return pd.DataFrame(final_df)
 
+    def close(self):
+        '''
+        Closes the browsers of the pool created by this scraper. A pool given to the scraper is left to its owner.
+        '''
+        if self.own_pool:
+            self.pool.close()
@@ -0,0 +1,109 @@
+import json
+import urllib3
+import pandas as pd
+import textdistance
+import numpy as np
+
+from unidecode import unidecode
+from concurrent.futures import ThreadPoolExecutor
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36"
+MESES = ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro']
+CARRO = 1
+
+class FipeApiClient(object):
+    def __init__(self, url:str='https://veiculos.fipe.org.br', timeout:int=10, max_workers:int=4):
+        """
+        Browserless client of the veiculos.fipe.org.br consultation. It posts the same forms the page selects post
+        (reference tables, brands, models, years and value) through pooled keep-alive connections, so a price costs a
+        few small JSON requests instead of browser round trips. Reference tables, brands, models and years are kept
+        once fetched, so rows of the same brand only cost the value request.
+        url: site root. Change it to use another server (eg: a local one).
+        timeout: seconds to wait for each request.
+        max_workers: number of rows searched at once.
+        """
+        self.url = url.rstrip('/')
+        self.max_workers = max_workers
+        self.http = urllib3.PoolManager(maxsize=max_workers, block=True, timeout=timeout, retries=urllib3.Retry(2, backoff_factor=0.3),
+                                        headers={'user-agent': USER_AGENT, 'referer': f"{self.url}/", 'x-requested-with': 'XMLHttpRequest'})
+        self.cache = {}
+
+    def post(self, endpoint:str, **fields):
+        """
+        Posts a form to an api/veiculos endpoint and returns the decoded JSON, keeping it for the next identical call.
+        """
+        key = (endpoint, tuple(sorted(fields.items())))
+        if key in self.cache:
+            return self.cache[key]
+
+        response = self.http.request('POST', f"{self.url}/api/veiculos/{endpoint}", fields={i: str(j) for i, j in fields.items()}, encode_multipart=False)
+        if response.status != 200:
+            raise ValueError(f"{endpoint} answered {response.status}: {response.data[:200]}")
+        data = json.loads(response.data.decode('utf-8'))
+        if isinstance(data, dict) and 'erro' in data:
+            raise ValueError(f"{endpoint} failed: {data['erro']}")
+        # Values change with every reference table, the other lists are kept.
+        if endpoint != 'ConsultarValorComTodosParametros':
+            self.cache[key] = data
+        return data
+
+    def formatar_data(self, mes, ano):
+        if mes < 1 or mes > 12:
+            return "Mês inválido"
+        return f"{MESES[mes - 1]}/{ano}"
+
+    def get_tabela(self, mes, ano) -> int:
+        mes_referencia = self.formatar_data(int(mes), ano)
+        for tabela in self.post('ConsultarTabelaDeReferencia'):
+            if tabela['Mes'].strip().lower() == mes_referencia:
+                return tabela['Codigo']
+        raise ValueError(f"Reference month '{mes_referencia}' not found.")
+
+    def get_marca(self, tabela:int, marca:str) -> str:
+        marcas = self.post('ConsultarMarcas', codigoTabelaReferencia=tabela, codigoTipoVeiculo=CARRO)
+        return [i['Value'] for i in marcas if marca.lower() in unidecode(i['Label'].lower())][0]
+
+    def get_modelo(self, tabela:int, marca:str, modelo:str) -> tuple:
+        """
+        (code, label) of the model closest to the given one, by levenshtein distance, as the browser scraper picks it.
+        """
+        modelos = self.post('ConsultarModelos', codigoTipoVeiculo=CARRO, codigoTabelaReferencia=tabela, codigoMarca=marca)['Modelos']
+        min_value = np.inf
+        for opt in modelos:
+            score = textdistance.levenshtein(modelo.lower(), unidecode(opt['Label'].lower()))
+            if score < min_value:
+                option_to_select = (opt['Value'], opt['Label'])
+                min_value = score
+        return option_to_select
+
+    def get_ano(self, tabela:int, marca:str, modelo, ano:str) -> tuple:
+        """
+        (model year, fuel code) of the first year option of the model with the given year that isn't diesel.
+        """
+        anos = self.post('ConsultarAnoModelo', codigoTipoVeiculo=CARRO, codigoTabelaReferencia=tabela, codigoMarca=marca, codigoModelo=modelo)
+        value = [i['Value'] for i in anos if ano in i['Label'] and 'diesel' not in i['Label'].lower()][0]
+        ano_modelo, combustivel = value.split('-')
+        return ano_modelo, combustivel
+
+    def search_row(self, row, month, year) -> pd.Series:
+        """
+        Average price of a ranking row, as a Series indexed by the FIPE model name, like the browser scraper.
+        """
+        tabela = self.get_tabela(month, year)
+        marca = self.get_marca(tabela, row['Brand'])
+        modelo, label = self.get_modelo(tabela, marca, row['Model'])
+        ano_modelo, combustivel = self.get_ano(tabela, marca, modelo, row['Year'].split('/')[0])
+        valor = self.post('ConsultarValorComTodosParametros', codigoTabelaReferencia=tabela, codigoMarca=marca, codigoModelo=modelo,
+                          codigoTipoVeiculo=CARRO, anoModelo=ano_modelo, codigoTipoCombustivel=combustivel, tipoVeiculo='carro',
+                          modeloCodigoExterno='', tipoConsulta='tradicional')
+        return pd.Series({valor.get('Modelo', label): valor['Valor']}, name='Preço Médio')
+
+    def search_price(self, df_selected:pd.DataFrame, month, year):
+        rows = list(df_selected.iterrows())
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda i: self.search_row(i[1], month, year), rows))
+
+        final_df = {}
+        for (i, row), result in zip(rows, results):
+            final_df[row['Model Info']] = result
+        return pd.DataFrame(final_df)
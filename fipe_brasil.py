@@ -3,6 +3,7 @@ import boto3, botocore
 import pandas as pd
 import textdistance
 import numpy as np
+from io import StringIO
 
 from unidecode import unidecode
 from selenium import webdriver
@@ -13,15 +14,32 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
+from bulk_dom import get_hrefs
 
 class FipeScraper(object):
-    def __init__(self, timeout=3):
+    def __init__(self, timeout=3, keep_open:bool=False):
+        '''
+        keep_open: if True, the browser is kept open between search_price calls and only closed by close(). Default
+            closes it at the end of every search, and the next search opens a new one. A with block also keeps it
+            open until the end of the block.
+        '''
         self.page_count = 1
         self.timeout = timeout
+        self.keep_open = keep_open
         self.url = 'https://www.tabelafipebrasil.com/carros'
         self.soup = None
+        self.brand_links = None
+        self.model_links = {}
+        self.year_links = {}
         self.setUp()
 
+    def __enter__(self):
+        self.keep_open = True
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def setUp(self):
         '''Setting up selenium driver. This functions has an extra chrome option for setting the default download directory to the /tmp/ path.'''
         caps = DesiredCapabilities.CHROME.copy()
@@ -95,26 +113,39 @@ class FipeScraper(object):
         ativar_seletor = Select(WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.XPATH, "//select[@id='selectTabelaReferenciacarro']"))))
         ativar_seletor.select_by_visible_text(self.formatar_data(int(mes), ano))
 
+    def get_brand_links(self) -> list:
+        '''Brand page links of the home page. The home page is only visited once per session.'''
+        if self.brand_links == None:
+            self.get()
+            self.set_tipo_veiculo()
+            self.brand_links = get_hrefs(self.driver, "//div[@class='pure-u-1-2 pure-u-md-1-2 pure-u-lg-1-3 fipe_link']/a")
+        return self.brand_links
+
+    def get_model_links(self, brand_link:str) -> list:
+        '''Model page links of a brand page. Each brand page is only visited once per session.'''
+        if brand_link not in self.model_links:
+            self.get(brand_link)
+            self.model_links[brand_link] = get_hrefs(self.driver, "//table//a")
+        return self.model_links[brand_link]
+
+    def get_year_links(self, model_link:str) -> list:
+        '''Model year page links of a model page. Each model page is only visited once per session.'''
+        if model_link not in self.year_links:
+            self.get(model_link)
+            self.year_links[model_link] = get_hrefs(self.driver, "//div[@class='DIVdetail']//table//a")
+        return self.year_links[model_link]
+
     def set_marca(self, marca:str):
         print('Definindo marca')
-        elements = WebDriverWait(self.driver, 10).until(EC.presence_of_all_elements_located((By.XPATH, "//div[@class='pure-u-1-2 pure-u-md-1-2 pure-u-lg-1-3 fipe_link']/a")))
-        
-        to_open = None
-
-        for element in elements:
-            link = element.get_attribute('href')
+        for link in self.get_brand_links():
             if marca.lower() in link.lower():
-                to_open = link
-                break
-        self.driver.get(to_open)
+                return link
+        return None
 
-    def set_modelo(self, modelo:str):
+    def set_modelo(self, modelo:str, links:list):
         print('Definindo modelo')
-        elements = WebDriverWait(self.driver, 10).until(EC.presence_of_all_elements_located((By.XPATH, "//table//a")))
-
         all_models = {'Link':[], 'Score':[]}
-        for element in elements:
-            this_href = element.get_attribute('href')
+        for this_href in links:
             this_model = this_href.split('/')[-1].replace('-', ' ')
 
             score = textdistance.levenshtein(modelo.lower(), this_model.lower())
@@ -124,12 +155,9 @@ class FipeScraper(object):
         
         return pd.DataFrame(all_models).drop_duplicates().sort_values('Score', ascending=True)
 
-    def set_ano(self, ano:str):
+    def set_ano(self, ano:str, links:list):
         print('Definindo ano')
-        elements = WebDriverWait(self.driver, 10).until(EC.presence_of_all_elements_located((By.XPATH, "//div[@class='DIVdetail']//table//a")))
-
-        for element in elements:
-            href = element.get_attribute('href')
+        for href in links:
             if ano in href and 'diesel' not in href.lower():
                 return href
         return None
@@ -142,38 +170,57 @@ class FipeScraper(object):
         print('Extraindo tabela')
         table = WebDriverWait(self.driver, 10).until(EC.presence_of_all_elements_located((By.XPATH, "//div[@class='site-content']//table[@style='width:100%']")))[0]
         table_html = table.get_attribute('outerHTML')
-        df = pd.read_html(table_html, header=0)
-        df.index = df[0].str.rstrip(':')
-        df.index = [i.lower() for i in df.index]
-        print(df)
+        df = pd.read_html(StringIO(table_html), header=0)[0]
+        df.index = [str(i).rstrip(':').lower() for i in df.pop(df.columns[0])]
         out = df.loc[self.formatar_data(mes, ano)]
         print(out)
         return out
 
     def search_price(self, df_selected:pd.DataFrame, month, year, locadora):
-        final_df = pd.DataFrame()
-        for i, row in df_selected.iterrows():
-            sel = row['Model Info']
-
-            self.get()
-            self.set_tipo_veiculo()
-            self.set_marca(row['Brand'])
-
-            if locadora == 'Localiza':
-                links_modelos = self.set_modelo(row['Model'])
-            else:
-                links_modelos = self.set_modelo(row['Model'] + row['Specification'])
-
-            found = None
-            for link in links_modelos['Link'].values:
-                self.get(link)
-                found = self.set_ano(row['Year'].split('/')[0])
-                if found != None:
-                    print('Found:', found)
-                    break
-
-            self.get(found)
-            final_df = pd.concat([final_df, pd.DataFrame({sel, self.get_table(year, month)})]) 
-
-        self.driver.close()
-        return final_df
\ No newline at end of file
+        '''
+        FIPE values of the selected rows for a reference month, one column per 'Model Info'. Rows are searched brand by
+        brand and every brand, model and model year page visited is remembered, so each one is loaded at most once.
+        '''
+        if self.driver == None:
+            self.setUp()
+        results = []
+        try:
+            for marca, brand_rows in df_selected.groupby('Brand', sort=False, observed=True):
+                brand_link = self.set_marca(str(marca))
+                for i, row in brand_rows.iterrows():
+                    sel = row['Model Info']
+                    if brand_link == None:
+                        print(f"Brand '{marca}' not found.")
+                        results.append((i, sel, None))
+                        continue
+
+                    if locadora == 'Localiza':
+                        links_modelos = self.set_modelo(row['Model'], self.get_model_links(brand_link))
+                    else:
+                        links_modelos = self.set_modelo(row['Model'] + row['Specification'], self.get_model_links(brand_link))
+
+                    found = None
+                    for link in links_modelos['Link'].values:
+                        found = self.set_ano(row['Year'].split('/')[0], self.get_year_links(link))
+                        if found != None:
+                            print('Found:', found)
+                            break
+
+                    if found == None:
+                        results.append((i, sel, None))
+                        continue
+                    self.get(found)
+                    results.append((i, sel, self.get_table(year, month)))
+        finally:
+            if not self.keep_open:
+                self.close()
+
+        # Results are built into a single frame, in the order of the selected rows.
+        order = {i: position for position, i in enumerate(df_selected.index)}
+        results = sorted(results, key=lambda i: order[i[0]])
+        return pd.DataFrame({sel: table if table is not None else pd.Series({'Valor': 'Not found'}) for i, sel, table in results})
+
+    def close(self):
+        if self.driver != None:
+            self.driver.quit()
+            self.driver = None
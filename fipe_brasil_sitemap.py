@@ -1,31 +1,162 @@
 import pandas as pd
-import textdistance
-from io import StringIO
+import os, re, json, time
+import urllib3
 
 from urllib.request import Request, urlopen
+from urllib.error import HTTPError
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
+from model_matcher import ModelMatcher, query_for, match_ranking
+from price_store import PriceStore, NOT_FOUND
+from fipe_table import extract_prices
+from typing import Union
+
+SEARCHING = 'Searching...'
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36"
 
 def float_to_currency(value_float:float):
     value_str = "{:,.2f}".format(value_float)
     return "R$ " + value_str
 
 
-def currency_to_float(value_str:str):
-    return float(value_str.replace("R$", "").strip().replace(".", "").replace(",", "."))
-    
+class SitemapIndex(object):
+    def __init__(self, url:str, path:str='/tmp/fipe_sitemap_index.json', max_age:int=24*3600, links:list=None):
+        """
+        Persisted index of the sitemap links keyed by brand and model year, so the candidates of a row are a
+        dictionary hit instead of a pass over every link. The index is kept in a local json file and, once it is
+        older than max_age, revalidated with the sitemap ETag/Last-Modified before being rebuilt.
+        url: sitemap url.
+        path: local file where the index is kept.
+        max_age: seconds before the index is revalidated.
+        links: index these links in memory instead (eg: the links of a snapshot). Nothing is read, downloaded or saved.
+        """
+        self.url = url
+        self.path = path
+        self.max_age = max_age
+        self.brand_matches = {}
+        if links is not None:
+            self.data = {'url': url, 'brands': self.build(links)}
+        else:
+            self.data = self.load()
+
+    def load(self) -> dict:
+        data = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('url') != self.url:
+                data = None
+            elif time.time() - data['fetched_at'] < self.max_age:
+                return data
+        return self.refresh(data)
+
+    def refresh(self, data:dict=None) -> dict:
+        """
+        Downloads the sitemap and rebuilds the index, unless the server answers that it didn't change since data was built.
+        data: index currently stored, if any.
+        """
+        req = Request(self.url)
+        req.add_header('user-agent', USER_AGENT)
+        if data is not None and data.get('etag'):
+            req.add_header('If-None-Match', data['etag'])
+        if data is not None and data.get('last_modified'):
+            req.add_header('If-Modified-Since', data['last_modified'])
+
+        try:
+            response = urlopen(req)
+        except HTTPError as e:
+            if e.code == 304 and data is not None:
+                data['fetched_at'] = time.time()
+                self.save(data)
+                return data
+            raise
+
+        print('Building sitemap index...')
+        xml = BeautifulSoup(response, 'lxml', from_encoding=response.info().get_param('charset'))
+        links = [loc.text for loc in xml.find_all('loc')]
+        data = {
+            'url': self.url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+            'brands': self.build(links),
+        }
+        self.save(data)
+        return data
+
+    @staticmethod
+    def get_years(segment:str) -> set:
+        """
+        Every 4 digits substring of a link year segment (eg: '2020-gasolina' -> {'2020'}), so that a dictionary
+        lookup by year matches the same links as a substring search.
+        """
+        years = set()
+        for digits in re.findall(r'\d{4,}', segment):
+            years.update([digits[i:i + 4] for i in range(len(digits) - 3)])
+        return years
+
+    def build(self, links:list) -> dict:
+        """
+        {brand: {year: [[link, model], ...]}}, brand being the lowercased brand segment of the link and model the
+        normalized model segment (lowercased, '-' replaced by spaces).
+        """
+        brands = {}
+        for link in links:
+            parts = link.split('/')
+            if len(parts) < 7:
+                continue
+            model = parts[5].replace('-', ' ').lower()
+            years = brands.setdefault(parts[4].lower(), {})
+            for year in self.get_years(parts[-1]):
+                years.setdefault(year, []).append([link, model])
+        return brands
+
+    def save(self, data:dict):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def candidates(self, marca:str, ano:str) -> list:
+        """
+        [link, model] pairs of every link of the brand and model year.
+        marca: brand as written in the listings (matched as a substring of the link brand).
+        ano: model year (eg: '2020').
+        """
+        marca = marca.lower()
+        if marca not in self.brand_matches:
+            self.brand_matches[marca] = [i for i in self.data['brands'] if marca in i]
+
+        found = []
+        for brand in self.brand_matches[marca]:
+            found.extend(self.data['brands'][brand].get(ano, []))
+        return found
+
 class FipeScraper(object):
-    def __init__(self, url:str=None, timeout=3):
+    max_candidates = 10
+    prefetch = 3
+    max_workers = 16
+    max_per_host = 8
+
+    def __init__(self, url:str=None, timeout=3, store:PriceStore=None):
+        """
+        url: sitemap url. Default is the tabelafipebrasil model/year sitemap.
+        timeout: seconds to connect to the server (reads may take up to 5 times longer).
+        store: PriceStore keeping the downloaded price tables. Default is a local store in /tmp.
+        """
         self.page_count = 1
+        self.store = store if store is not None else PriceStore()
         self.timeout = timeout
+        self.http = urllib3.PoolManager(maxsize=self.max_per_host, block=True, headers={'user-agent': USER_AGENT},
+                                        timeout=urllib3.Timeout(connect=timeout, read=timeout*5), retries=urllib3.Retry(2, backoff_factor=0.3))
 
         if url == None:
             self.url = 'https://www.tabelafipebrasil.com/sitemaps/sitemap_model_yearA.xml'
         else:
             self.url = url
 
-        self.sitemap = self.get_sitemap()
-        self.links = self.get_links()
+        self.index = SitemapIndex(self.url)
 
     def formatar_data(self, ano, mes):
         nomes_meses = {
@@ -54,92 +185,144 @@ class FipeScraper(object):
             url = self.url
         
         req = Request(url)
-        req.add_header('user-agent', "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36")
+        req.add_header('user-agent', USER_AGENT)
         response = urlopen(req)
         xml = BeautifulSoup(response, 'lxml', from_encoding=response.info().get_param('charset'))
 
         return xml
     
-    def get_this_price(self, url_list:str, ano, mes):
-        for url in url_list:
-            req = Request(url)
-            req.add_header('user-agent', "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36")
-            response = urlopen(req).read()
-            soup = BeautifulSoup(response, 'html.parser')
-            html_table = soup.find('table', {'style': 'width:100%'})
-            table = pd.read_html(StringIO(str(html_table)), header=0)[0]
-            table = table[['Mês', 'Valor']]
-            table.index = table.pop('Mês')
-            table.index = [i.lower() for i in table.index]
-            try:
-                value = table.loc[self.formatar_data(ano, mes)]['Valor']
-                return value, url.split('/')[5].replace('-', ' ')
-            except:
-                pass
-        return 'Not found', url.split('/')[5].replace('-', ' ')
+    @staticmethod
+    def get_reference(url:str) -> str:
+        return url.split('/')[5].replace('-', ' ')
 
-    def get_links(self, xml:str=None):
-        if xml == None:
-            xml = self.sitemap
-        loc_elements = xml.find_all('loc')
-        loc_texts = [loc.text for loc in loc_elements]
-        return loc_texts
+    def get_table(self, url:str) -> Union[dict,None]:
+        """
+        Downloads a model page through the pooled connections, parses its price table and keeps it in the price store.
+        Returns {month: value} with the lowercased months (eg: 'janeiro 2024') and float values, an empty dictionary when the page has
+        no price table, or None when the page couldn't be downloaded (which isn't stored, so it is tried again later).
+        """
+        try:
+            response = self.http.request('GET', url)
+            if response.status != 200:
+                raise HTTPError(url, response.status, response.reason, response.headers, None)
+        except Exception as e:
+            print(f"Couldn't download '{url}': {e}")
+            return None
 
-    def get_more_probable(self, row, links, locadora):
+        try:
+            table = dict(extract_prices(response.data))
+        except Exception as e:
+            print(f"Couldn't read the price table of '{url}': {e}")
+            table = {}
+        self.store.put(url, table)
+        return table
 
-        if locadora == 'Localiza':
-            modelo = row['Model']
-        else:
-            modelo = row['Model'] + ' ' + row['Specification']
+    def get_prices(self, url_lists:list, ano, mes, callback=None) -> list:
+        """
+        Price of the first url having the month, for every list of candidate urls, as (price, reference model).
+        Pages already in the price store are answered from it. The others are downloaded concurrently over keep-alive
+        connections, at most max_per_host at once per host: the first `prefetch` pages to download of every list are
+        requested right away, and every page that doesn't match requests the next one. A list stops at its first match,
+        in rank order, and its pending downloads are cancelled.
+        url_lists: lists of candidate urls, each sorted from the most to the least probable.
+        callback: called as callback(position, (price, reference model)) as soon as each list is resolved.
+        """
+        month = self.formatar_data(ano, mes)
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            cached, to_fetch, futures = [], [], []
+            for url_list in url_lists:
+                this_cached = self.store.lookup(url_list, month) if len(url_list) > 0 else []
+                # Only the pages ranked before the first cached price can be needed.
+                this_fetch = []
+                for url, answer in zip(url_list, this_cached):
+                    if answer is not None and answer != NOT_FOUND:
+                        break
+                    if answer is None:
+                        this_fetch.append(url)
+                cached.append(this_cached)
+                to_fetch.append(this_fetch)
+                futures.append({url: executor.submit(self.get_table, url) for url in this_fetch[:self.prefetch]})
 
-        all_models = {'Links':[], 'Score':[]}
-        for link in links:
-            this_model = link.split('/')[5].replace('-', ' ')
+            for i, url_list in enumerate(url_lists):
+                result = (NOT_FOUND, self.get_reference(url_list[-1]) if len(url_list) > 0 else '')
+                for url, answer in zip(url_list, cached[i]):
+                    if answer == NOT_FOUND:
+                        continue
+                    if answer is not None:
+                        result = (answer, self.get_reference(url))
+                        break
 
-            levenshtein_score = textdistance.damerau_levenshtein(modelo.lower().replace('.', '').replace('-', ' '), this_model.lower())
-            jaccard_score = 1 - textdistance.jaccard(modelo.lower().replace('.', '').replace('-', ' '), this_model.lower())
+                    position = to_fetch[i].index(url)
+                    for ahead in to_fetch[i][position:position + self.prefetch + 1]:
+                        if ahead not in futures[i]:
+                            futures[i][ahead] = executor.submit(self.get_table, ahead)
 
-            if locadora == 'Localiza':
-                additional_score_by = row['Model'].lower().split(' ')[0]
-            else:
-                additional_score_by = row['Model'].lower()
-            if additional_score_by in this_model.lower():
-                levenshtein_score -= levenshtein_score * 0.15
+                    table = futures[i][url].result()
+                    if table is not None and month in table:
+                        result = (table[month], self.get_reference(url))
+                        break
 
+                for future in futures[i].values():
+                    future.cancel()
+                results.append(result)
+                if callback is not None:
+                    callback(i, result)
+        self.store.sync()
+        return results
 
-            all_models['Links'].append(link)
-            all_models['Score'].append(jaccard_score * levenshtein_score)
-        
-        sorted_df = pd.DataFrame(all_models).drop_duplicates().sort_values('Score', ascending=True)
-        return sorted_df['Links'].values, modelo
+    def get_this_price(self, url_list:list, ano, mes):
+        return self.get_prices([url_list], ano, mes)[0]
+
+    def get_links(self, xml:str=None):
+        if xml == None:
+            xml = self.get_sitemap()
+        loc_elements = xml.find_all('loc')
+        loc_texts = [loc.text for loc in loc_elements]
+        return loc_texts
+
+    def get_more_probable(self, row, candidates, locadora, top_k:int=None):
+        '''
+        Sorts the candidate links from the most to the least probable match of the row model.
+        candidates: [link, model] pairs, as returned by SitemapIndex.candidates.
+        top_k: only return the top_k most probable links. Default returns every candidate.
+        '''
+        modelo, bonus = query_for(row, locadora)
+        return ModelMatcher(candidates).match(modelo, bonus, top_k), modelo
     
-    def search_price(self, df_selected:pd.DataFrame, ano_ref, mes, locadora):
-        # Tamanho padrão: 7
-        # 4: marca; 5: modelo; 6: ano
-
-        data = {'Rank':[], 'Model':[], 'Price':[], 'Collected Price':[], 'Price Diff':[], 'Reference Model':[]}
-        for i, row in df_selected.iterrows():
-            sel = row['Model Info']
-
-            marca = row['Brand']
-            
-            modelo_ano = row['Year'].split('/')[0]
-
-            this_possibilities = [i for i in self.links if marca.lower() in i.split('/')[4].lower() and modelo_ano in i.split('/')[-1]]
-            most_probables, modelo = self.get_more_probable(row, this_possibilities, locadora)
-            price, reference = self.get_this_price(most_probables, ano_ref, mes)
-
-            if price != 'Not found':
-                float_price = currency_to_float(price)
-                data['Price Diff'].append("{:.2f} %".format(-(float_price - row['Median Prices'])/(float_price)*100))
-            else:
-                data['Price Diff'].append('-')
+    def search_rows(self, df_selected:pd.DataFrame, ano_ref, mes, locadora, callback=None) -> list:
+        """
+        (price, reference model) of every ranking row, in the rows order. The price is a float, or NOT_FOUND.
+        df_selected: ranking rows with 'Brand', 'Model', 'Specification' (except for Localiza) and 'Year'.
+        callback: called as callback(position, (price, reference model)) as soon as each row is resolved.
+        """
+        matches = match_ranking(df_selected, self.index, locadora, top_k=self.max_candidates)
+        return self.get_prices([matches[i][0] for i in df_selected.index], ano_ref, mes, callback=callback)
+
+    @staticmethod
+    def price_table(df_selected:pd.DataFrame, prices:list, locadora) -> pd.DataFrame:
+        """
+        FIPE comparison table of the ranking rows.
+        prices: (price, reference model) of every row, in the rows order, or None for the rows still being searched.
+        """
+        data = {'Rank':[], 'Model':[], 'Price':[], 'Collected Price':[], 'Reference Model':[]}
+        median_prices = []
+        for (i, row), found in zip(df_selected.iterrows(), prices):
+            price, reference = found if found is not None else (SEARCHING, '')
+
             data['Rank'].append(row['Posição'])
-            data['Model'].append(modelo)
+            data['Model'].append(query_for(row, locadora)[0])
             data['Price'].append(price)
             data['Collected Price'].append(float_to_currency(row['Median Prices']))
             data['Reference Model'].append(reference)
-        
-        return pd.DataFrame(data)
-            
+            median_prices.append(row['Median Prices'])
+
+        float_prices = pd.Series([i if isinstance(i, (int, float)) else None for i in data['Price']], dtype='float64')
+        price_diff = -(float_prices - pd.Series(median_prices, dtype='float64')) / float_prices * 100
+        data['Price'] = [float_to_currency(i) if pd.notna(i) else j for i, j in zip(float_prices, data['Price'])]
+        data['Price Diff'] = ["{:.2f} %".format(i) if pd.notna(i) else '-' for i in price_diff]
 
+        return pd.DataFrame(data)[['Rank', 'Model', 'Price', 'Collected Price', 'Price Diff', 'Reference Model']]
+
+    def search_price(self, df_selected:pd.DataFrame, ano_ref, mes, locadora):
+        return self.price_table(df_selected, self.search_rows(df_selected, ano_ref, mes, locadora), locadora)
@@ -0,0 +1,100 @@
+import queue, threading
+import pandas as pd
+from collections import OrderedDict
+from fipe_brasil_sitemap import FipeScraper
+
+FAILED = 'Failed'
+
+class FipeJobs(object):
+    def __init__(self, scraper:FipeScraper, max_results:int=5000, idle_timeout:int=60):
+        """
+        Background queue of FIPE searches shared by every dashboard session. Each ranking row is a job keyed by
+        company, model, model year and reference month, so identical requests of different sessions (or of reruns
+        of the same session) are searched only once. A single worker thread takes the queued jobs in batches and
+        publishes each row result as soon as it is found, so the sessions can poll partial results.
+        The worker stops after idle_timeout seconds without jobs and is started again by the next submit().
+        scraper: FipeScraper used by the worker.
+        max_results: number of finished jobs kept in memory. The oldest ones are forgotten first.
+        idle_timeout: seconds the worker waits for new jobs before stopping.
+        """
+        self.scraper = scraper
+        self.max_results = max_results
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.jobs = OrderedDict()
+        self.worker = None
+
+    @staticmethod
+    def get_key(row, ano_ref, mes, locadora) -> tuple:
+        return (locadora, str(row['Brand']), str(row['Model']), str(row.get('Specification', '')), str(row['Year']), int(ano_ref), int(mes))
+
+    def submit(self, df_selected:pd.DataFrame, ano_ref, mes, locadora) -> list:
+        """
+        Queues the search of the ranking rows that are neither searched nor queued yet (failed searches are queued again).
+        df_selected: ranking rows with 'Brand', 'Model', 'Specification' (except for Localiza) and 'Year'.
+        Returns the job keys of the rows, to be given to results().
+        """
+        keys = []
+        with self.lock:
+            for i, row in df_selected.iterrows():
+                key = self.get_key(row, ano_ref, mes, locadora)
+                if key not in self.jobs or self.jobs[key] == (FAILED, ''):
+                    self.jobs[key] = None
+                    self.queue.put(key)
+                keys.append(key)
+
+            if self.worker is None and not self.queue.empty():
+                self.worker = threading.Thread(target=self.work, daemon=True)
+                self.worker.start()
+        return keys
+
+    def results(self, keys:list) -> list:
+        """
+        (price, reference model) of every job, or None for the jobs that are still queued or running.
+        """
+        with self.lock:
+            return [self.jobs.get(key) for key in keys]
+
+    def pending(self, keys:list) -> int:
+        return len([i for i in self.results(keys) if i is None])
+
+    def finish(self, key:tuple, result:tuple):
+        with self.lock:
+            self.jobs[key] = result
+            self.jobs.move_to_end(key)
+            finished = [i for i, j in self.jobs.items() if j is not None]
+            for i in finished[:max(len(finished) - self.max_results, 0)]:
+                del self.jobs[i]
+
+    def work(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                # Jobs are only queued while holding the lock, so none can be missed between the check and the stop.
+                with self.lock:
+                    if self.queue.empty():
+                        self.worker = None
+                        return
+                continue
+
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            groups = {}
+            for key in batch:
+                groups.setdefault((key[0], key[5], key[6]), []).append(key)
+
+            for (locadora, ano_ref, mes), keys in groups.items():
+                rows = pd.DataFrame([{'Brand': i[1], 'Model': i[2], 'Specification': i[3], 'Year': i[4]} for i in keys])
+                try:
+                    self.scraper.search_rows(rows, ano_ref, mes, locadora, callback=lambda position, result: self.finish(keys[position], result))
+                except Exception as e:
+                    print(f"FIPE search of {len(keys)} models failed: {e}")
+                    for key in keys:
+                        if self.results([key])[0] is None:
+                            self.finish(key, (FAILED, ''))
@@ -0,0 +1,155 @@
+import sys, time
+import numpy as np
+import pandas as pd
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+from S3Work import S3Facilities
+from price_store import PriceStore, NOT_FOUND
+from model_matcher import match_ranking
+from fipe_brasil_sitemap import FipeScraper, SitemapIndex
+
+PRICES_KEY = 'used-cars-for-sale/fipe/prices.sqlite'
+
+class FipeSnapshot(object):
+    batch_size = 1000
+    sync_interval = 600
+
+    def __init__(self, s3:S3Facilities, scraper:FipeScraper=None, root:str='used-cars-for-sale/fipe/snapshots'):
+        """
+        Monthly snapshot of the FIPE value of every model year page of the sitemap, stored as one parquet file per
+        reference month with the Brand, Model, Model Year, Month, Value and Link columns. Once the snapshot of a month
+        exists, the FIPE comparison of a ranking is a local join (see search_rows), without any request.
+        s3: S3Facilities instance where the snapshots are kept.
+        scraper: FipeScraper used to crawl the pages. Default creates one with the price store shared in S3, so the
+            pages already downloaded by the dashboard or by an interrupted crawl are not downloaded again.
+        root: S3 prefix of the snapshots.
+        """
+        self.s3 = s3
+        self.scraper = scraper
+        self.root = root
+
+    def get_scraper(self) -> FipeScraper:
+        if self.scraper is None:
+            self.scraper = FipeScraper(store=PriceStore('/tmp/fipe_prices_snapshot.sqlite', s3=self.s3, key=PRICES_KEY))
+        return self.scraper
+
+    def get_key(self, ano, mes) -> str:
+        return f"{self.root}/{int(ano)}-{int(mes):02d}.parquet"
+
+    def links(self) -> list:
+        """
+        Every model year link of the sitemap, once each.
+        """
+        links = {}
+        for years in self.get_scraper().index.data['brands'].values():
+            for pairs in years.values():
+                links.update({link: None for link, model in pairs})
+        return list(links)
+
+    def crawl(self, ano, mes, max_workers:int=None) -> pd.DataFrame:
+        """
+        Downloads the pages that don't have an answer for the month in the price store yet, with at most max_workers
+        downloads at once, and writes the snapshot of the month (see write). The store is kept in its own local file
+        and merged into the shared one at most every sync_interval seconds and when the crawl ends or is interrupted,
+        so an interrupted crawl resumes where it stopped, pages that failed are the only ones tried again, and the
+        number of uploads depends on the crawl duration, not on the number of pages.
+        ano: reference year.
+        mes: reference month.
+        max_workers: number of pages downloaded at once. Default is the scraper max_workers.
+        Returns the snapshot, or None if the month has no value.
+        """
+        scraper = self.get_scraper()
+        month = scraper.formatar_data(ano, mes)
+        links = self.links()
+        pending = [url for url, answer in zip(links, scraper.store.lookup(links, month)) if answer is None]
+        print(f"{len(links) - len(pending)} of {len(links)} pages already known for {month}, {len(pending)} to download...")
+
+        synced_at = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers if max_workers is not None else scraper.max_workers) as executor:
+                for start in range(0, len(pending), self.batch_size):
+                    list(executor.map(scraper.get_table, pending[start:start + self.batch_size]))
+                    print(f"{min(start + self.batch_size, len(pending))} of {len(pending)} pages downloaded.")
+                    if time.time() - synced_at >= self.sync_interval:
+                        scraper.store.sync()
+                        synced_at = time.time()
+        finally:
+            scraper.store.sync()
+
+        return self.write(ano, mes, links)
+
+    def write(self, ano, mes, links:list) -> pd.DataFrame:
+        """
+        Writes the snapshot of a month from the price store. Links without a value for the month are kept with a
+        NaN value, so the join picks the same links an on-demand search would.
+        Nothing is written when no link has a value (eg: a month that isn't published yet), so the dashboard keeps
+        searching that month on demand.
+        Returns the snapshot, or None if it wasn't written.
+        """
+        scraper = self.get_scraper()
+        answers = scraper.store.lookup(links, scraper.formatar_data(ano, mes))
+        parts = [i.split('/') for i in links]
+        snapshot = pd.DataFrame({
+            'Brand': [i[4].lower() for i in parts],
+            'Model': [i[5].replace('-', ' ').lower() for i in parts],
+            'Model Year': [i[-1] for i in parts],
+            'Month': f"{int(ano)}-{int(mes):02d}",
+            'Value': pd.Series([i if isinstance(i, (int, float)) else np.nan for i in answers], dtype='float64'),
+            'Link': links,
+        })
+        for column in ['Brand', 'Model', 'Model Year', 'Month']:
+            snapshot[column] = snapshot[column].astype('category')
+
+        if snapshot['Value'].notna().sum() == 0:
+            print(f"No value found for {scraper.formatar_data(ano, mes)}, the snapshot was not written.")
+            return None
+
+        self.s3.put_file(snapshot, self.get_key(ano, mes), index=False)
+        print(f"Snapshot of {len(snapshot)} pages written, {snapshot['Value'].notna().sum()} with a value.")
+        return snapshot
+
+    def load(self, ano, mes) -> pd.DataFrame:
+        """
+        Snapshot of a month, or None if it wasn't crawled.
+        """
+        snapshot = self.s3.file_exists(self.get_key(ano, mes), get_object=True)
+        return snapshot if isinstance(snapshot, pd.DataFrame) else None
+
+    @staticmethod
+    def prepare(snapshot:pd.DataFrame) -> tuple:
+        """
+        (prices, index) of a snapshot, as used by search_rows: a {link: value} dictionary and an in-memory
+        SitemapIndex of the snapshot links.
+        """
+        links = list(snapshot['Link'])
+        return dict(zip(links, snapshot['Value'])), SitemapIndex(None, links=links)
+
+    @staticmethod
+    def search_rows(df_selected:pd.DataFrame, locadora, prices:dict, index:SitemapIndex, top_k:int=FipeScraper.max_candidates) -> list:
+        """
+        Local join of the ranking rows with a snapshot: the candidates of every row are matched as in
+        FipeScraper.search_rows and the first one with a value is taken.
+        Returns (price, reference model) of every row, in the rows order, ready for FipeScraper.price_table. Rows
+        whose candidates have no value in the snapshot are None, like pending FipeJobs results, so they can be
+        searched on demand.
+        """
+        matches = match_ranking(df_selected, index, locadora, top_k=top_k)
+        results = []
+        for i in df_selected.index:
+            links = matches[i][0]
+            result = None if len(links) > 0 else (NOT_FOUND, '')
+            for url in links:
+                if pd.notna(prices.get(url, np.nan)):
+                    result = (float(prices[url]), FipeScraper.get_reference(url))
+                    break
+            results.append(result)
+        return results
+
+if __name__ == "__main__":
+    # python fipe_snapshot.py [year] [month], the current month by default.
+    today = date.today()
+    ano = int(sys.argv[1]) if len(sys.argv) > 1 else today.year
+    mes = int(sys.argv[2]) if len(sys.argv) > 2 else today.month
+
+    FipeSnapshot(S3Facilities('alternative-market-data', 'us-east-1')).crawl(ano, mes)
@@ -0,0 +1,31 @@
+import lxml.html
+from parsing import parse_currency
+
+TABLE_XPATH = '//table[@style="width:100%"]'
+
+def extract_prices(html:bytes) -> list:
+    """
+    Price history of a model page, read straight from the rows of its table[style="width:100%"] with lxml.
+    Returns [(month, value), ...] with the lowercased month (eg: 'janeiro 2024') and the value as a float,
+    or an empty list when the page has no such table.
+    html: page content.
+    """
+    tables = lxml.html.fromstring(html).xpath(TABLE_XPATH)
+    if len(tables) == 0:
+        return []
+
+    month_column, value_column = 0, 1
+    months, values = [], []
+    for tr in tables[0].iter('tr'):
+        cells = [' '.join(i.text_content().split()) for i in tr if i.tag in ('td', 'th')]
+        if len(cells) == 0:
+            continue
+        if 'Mês' in cells and 'Valor' in cells:
+            month_column, value_column = cells.index('Mês'), cells.index('Valor')
+            continue
+        if len(cells) <= max(month_column, value_column):
+            continue
+        months.append(cells[month_column].lower())
+        values.append(cells[value_column])
+
+    return list(zip(months, parse_currency(values).tolist()))
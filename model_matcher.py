@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import textdistance
+
+try:
+    from rapidfuzz.distance import OSA
+except ImportError:
+    OSA = None
+
+def query_for(row, locadora:str) -> tuple:
+    """
+    Model text searched for a ranking row and the token that gives the 15% bonus to the candidates containing it.
+    Localiza rows are searched by model only and get the bonus from the first word of the model, the other
+    companies are searched by model and specification and get the bonus from the whole model.
+    row: ranking row with 'Model' and 'Specification'.
+    locadora: company name.
+    """
+    if locadora == 'Localiza':
+        modelo = row['Model']
+        bonus = row['Model'].lower().split(' ')[0]
+    else:
+        modelo = row['Model'] + ' ' + row['Specification']
+        bonus = row['Model'].lower()
+    return modelo, bonus
+
+def ngrams(text:str, n:int=3) -> set:
+    text = f" {text} "
+    return set([text[i:i + n] for i in range(max(len(text) - n + 1, 1))])
+
+class ModelMatcher(object):
+    def __init__(self, candidates:list):
+        """
+        Scores model names against a fixed set of candidate links. The candidates are indexed once: a trigram
+        inverted index for blocking and a character count matrix for the jaccard distance, so scoring a query is a
+        couple of vectorized operations plus one C-backed edit distance per kept candidate.
+        candidates: [link, model] pairs (eg: SitemapIndex.candidates), model being lowercased.
+        """
+        self.links = [i[0] for i in candidates]
+        self.models = [i[1] for i in candidates]
+
+        self.inverted = {}
+        for position, model in enumerate(self.models):
+            for gram in ngrams(model):
+                self.inverted.setdefault(gram, []).append(position)
+
+        alphabet = sorted(set(''.join(self.models)))
+        self.alphabet = {char: i for i, char in enumerate(alphabet)}
+        self.counts = np.zeros((len(self.models), len(alphabet)), dtype=np.int32)
+        for position, model in enumerate(self.models):
+            for char in model:
+                self.counts[position, self.alphabet[char]] += 1
+
+    def block(self, query:str, min_candidates:int) -> np.ndarray:
+        """
+        Positions of the candidates sharing at least one trigram with the query. Every candidate is kept when
+        blocking would leave less than min_candidates of them.
+        """
+        found = set()
+        for gram in ngrams(query):
+            found.update(self.inverted.get(gram, []))
+        if len(found) < min_candidates:
+            return np.arange(len(self.models))
+        return np.array(sorted(found))
+
+    def jaccard_distance(self, query:str, positions:np.ndarray) -> np.ndarray:
+        """
+        1 - jaccard similarity between the character multisets of the query and of each candidate,
+        the same as 1 - textdistance.jaccard(query, model).
+        """
+        query_counts = np.zeros(self.counts.shape[1], dtype=np.int32)
+        extra = 0
+        for char in query:
+            if char in self.alphabet:
+                query_counts[self.alphabet[char]] += 1
+            else:
+                extra += 1
+
+        counts = self.counts[positions]
+        intersection = np.minimum(counts, query_counts).sum(axis=1)
+        union = np.maximum(counts, query_counts).sum(axis=1) + extra
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.where(union > 0, intersection / union, 1.0)
+        return 1 - similarity
+
+    def edit_distance(self, query:str, positions:np.ndarray) -> np.ndarray:
+        """
+        Restricted Damerau-Levenshtein distance (optimal string alignment), as textdistance.damerau_levenshtein.
+        """
+        if OSA is not None:
+            return np.array([OSA.distance(query, self.models[i]) for i in positions], dtype=np.float64)
+        return np.array([textdistance.damerau_levenshtein(query, self.models[i]) for i in positions], dtype=np.float64)
+
+    def score(self, modelo:str, bonus:str, positions:np.ndarray=None) -> tuple:
+        """
+        Scores of the candidates, lower is better: jaccard distance * edit distance, the edit distance being
+        reduced by 15% for the candidates that contain the bonus token.
+        Returns the (positions, scores) arrays.
+        """
+        query = modelo.lower().replace('.', '').replace('-', ' ')
+        if positions is None:
+            positions = np.arange(len(self.models))
+
+        levenshtein = self.edit_distance(query, positions)
+        has_bonus = np.array([bonus in self.models[i] for i in positions], dtype=bool)
+        levenshtein = np.where(has_bonus, levenshtein - levenshtein * 0.15, levenshtein)
+        return positions, self.jaccard_distance(query, positions) * levenshtein
+
+    def lower_bound(self, query:str, positions:np.ndarray) -> np.ndarray:
+        """
+        Cheap lower bound of the score of the candidates: the edit distance is at least the length difference.
+        """
+        lengths = np.array([len(self.models[i]) for i in positions], dtype=np.float64)
+        return self.jaccard_distance(query, positions) * np.abs(lengths - len(query)) * 0.85
+
+    def match(self, modelo:str, bonus:str, top_k:int=None) -> list:
+        """
+        Candidate links sorted from the most to the least probable. With top_k only the best top_k are selected,
+        without sorting the whole candidate list: the candidates sharing trigrams with the query are scored first,
+        and the others are only scored when their lower bound could still beat the top_k-th score.
+        modelo: model text of the row (see query_for).
+        bonus: bonus token of the row (see query_for).
+        top_k: number of links to return. Default returns every candidate.
+        """
+        if len(self.models) == 0:
+            return []
+
+        query = modelo.lower().replace('.', '').replace('-', ' ')
+        if top_k is None or top_k >= len(self.models):
+            positions, scores = self.score(modelo, bonus)
+        else:
+            positions, scores = self.score(modelo, bonus, self.block(query, top_k))
+            if len(positions) < len(self.models):
+                threshold = np.partition(scores, top_k - 1)[top_k - 1]
+                others = np.setdiff1d(np.arange(len(self.models)), positions)
+                others = others[self.lower_bound(query, others) <= threshold]
+                if len(others) > 0:
+                    others, other_scores = self.score(modelo, bonus, others)
+                    positions = np.concatenate([positions, others])
+                    scores = np.concatenate([scores, other_scores])
+
+            threshold = np.partition(scores, top_k - 1)[top_k - 1]
+            kept = scores <= threshold
+            positions, scores = positions[kept], scores[kept]
+        order = np.lexsort((positions, scores))
+
+        links, seen = [], set()
+        for i in positions[order]:
+            if self.links[i] not in seen:
+                seen.add(self.links[i])
+                links.append(self.links[i])
+        return links[:top_k] if top_k is not None else links
+
+def match_ranking(df_selected:pd.DataFrame, index, locadora:str, top_k:int=None) -> dict:
+    """
+    Matches every row of a ranking at once. Rows sharing brand and model year share a single ModelMatcher,
+    so each candidate set is indexed only once.
+    df_selected: ranking rows with 'Brand', 'Model', 'Specification' and 'Year'.
+    index: SitemapIndex used to find the candidates.
+    locadora: company name.
+    top_k: number of links kept per row. Default keeps every candidate.
+    Returns {row index: (sorted links, modelo)}.
+    """
+    matchers = {}
+    matches = {}
+    for i, row in df_selected.iterrows():
+        key = (row['Brand'], row['Year'].split('/')[0])
+        if key not in matchers:
+            matchers[key] = ModelMatcher(index.candidates(*key))
+
+        modelo, bonus = query_for(row, locadora)
+        matches[i] = (matchers[key].match(modelo, bonus, top_k), modelo)
+    return matches
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from typing import Union
+
+CATEGORICAL_COLUMNS = ['Brand', 'Model', 'Specification', 'Year', 'Model Info']
+
+def parse_currency(values:Union[pd.Series,list,np.ndarray]) -> pd.Series:
+    """
+    Vectorized conversion of brazilian currency strings (eg: 'R$ 12.345' or 'R$ 12.345,67') to float64.
+    values: Series, list or array of strings. Values that are already numeric are only cast to float64.
+    Values that can't be parsed become NaN.
+    """
+    values = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float64')
+
+    cleaned = (values.astype(str)
+               .str.replace('R$', '', regex=False)
+               .str.strip()
+               .str.replace('.', '', regex=False)
+               .str.replace(',', '.', regex=False))
+    return pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+def apply_schema(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a typed copy of a listings frame: float64 prices and categorical Brand/Model/Specification/Year/Model Info.
+    It can be applied more than once, already typed columns are kept as they are.
+    df: listings frame with the raw columns of the daily snapshots.
+    """
+    df = df.copy()
+    if 'Price' in df.columns:
+        df['Price'] = parse_currency(df['Price'])
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+def model_info(df:pd.DataFrame, locadora:str) -> pd.Series:
+    """
+    Builds the 'Model Info' label of each listing. Localiza listings don't have a meaningful Specification,
+    so it is only used for the other companies.
+    df: listings frame.
+    locadora: company name (eg: 'Localiza' or 'localiza').
+    """
+    if locadora.lower() == 'localiza':
+        columns = ['Brand', 'Model', 'Year']
+    else:
+        columns = ['Brand', 'Model', 'Specification', 'Year']
+
+    info = df[columns[0]].astype(str)
+    for column in columns[1:]:
+        info = info + ' ' + df[column].astype(str)
+    return info
+
+def assign_model_ids(df:pd.DataFrame, locadora:str, models:dict) -> pd.DataFrame:
+    """
+    Returns a copy of df with a categorical 'Model Info' label and a stable integer 'Model ID'.
+    The label is only built once per distinct model, and ids are taken from the models dictionary,
+    which gets the next free id for every label it didn't know yet.
+    df: typed listings frame.
+    locadora: company name, defines how the Model Info label is built.
+    models: {Model Info: Model ID} dictionary of the company. It is updated in place.
+    """
+    labels = model_info(df, locadora).astype('category')
+    for label in labels.cat.categories:
+        if label not in models:
+            models[label] = len(models)
+
+    category_ids = np.array([models[i] for i in labels.cat.categories], dtype='int32')
+    return df.assign(**{'Model Info': labels, 'Model ID': category_ids[labels.cat.codes]})
@@ -0,0 +1,218 @@
+import os, time, sqlite3, tempfile, threading
+import botocore
+import pandas as pd
+from typing import Union
+from parsing import parse_currency
+
+MONTHS = ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro']
+NOT_FOUND = 'Not found'
+# Stored as the SQLite user_version. 1: prices as REAL numbers instead of the currency strings of version 0.
+SCHEMA_VERSION = 1
+
+def period(month:str) -> Union[int,None]:
+    """
+    Sortable number of a FIPE reference month (eg: 'janeiro 2024' -> 2024*12 + 0), or None if it can't be parsed.
+    """
+    parts = month.lower().split(' ')
+    if len(parts) != 2 or parts[0] not in MONTHS or not parts[1].isdigit():
+        return None
+    return int(parts[1])*12 + MONTHS.index(parts[0])
+
+def to_price(value) -> Union[float,None]:
+    """
+    Price stored by an older schema as a number or text (eg: 97813.39, '97813.39' or 'R$ 97.813,39'), or None if it
+    can't be parsed.
+    """
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        price = parse_currency([value]).iloc[0]
+    return None if pd.isna(price) else price
+
+class PriceStore(object):
+    chunk_size = 900
+
+    def __init__(self, path:str='/tmp/fipe_prices.sqlite', s3=None, key:str=None, negative_ttl:int=24*3600, sync_interval:int=0):
+        """
+        Persistent store of the FIPE price history of every model page already downloaded, so a month of a known page
+        is answered without any request. The published months of a page never change, only new months are added, so:
+            - a month stored for the page is returned as it is;
+            - a month older than the last month of the page is a definitive 'Not found';
+            - a newer month is 'Not found' for negative_ttl seconds after the page was downloaded, then it's looked up again.
+        The store is a SQLite file, that can be shared through S3 by many processes (eg: the dashboard and
+        fipe_snapshot): the shared copy is merged into the local file on creation, and sync() merges it again before
+        uploading, so the rows written by the others are kept.
+        path: local SQLite file. Processes sharing the store through S3 must not share this file.
+        s3: S3Facilities instance used to share the file. Default keeps it local only.
+        key: S3 key of the shared file. Only used with s3.
+        negative_ttl: seconds a missing recent month is cached as 'Not found'.
+        sync_interval: minimum seconds between two uploads. The changes of a sync() called sooner wait for the next one.
+        """
+        self.path = path
+        self.s3 = s3
+        self.key = key
+        self.negative_ttl = negative_ttl
+        self.sync_interval = sync_interval
+        self.synced_at = 0
+        self.lock = threading.Lock()
+        self.changed = False
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.changed = self.create(self.connection, self.path) > 0
+        if self.s3 is not None and self.key is not None:
+            self.pull()
+
+    @staticmethod
+    def create(connection:sqlite3.Connection, path:str) -> int:
+        """
+        Creates the tables of an empty store, or converts a store written by an older schema (eg: downloaded from S3)
+        to the current one: the prices table is created again with a REAL value column and every stored value is
+        parsed to a float. Values that can't be parsed are kept as NULL, so their pages are downloaded again.
+        Returns the number of migrated prices.
+        """
+        connection.execute("CREATE TABLE IF NOT EXISTS prices (url TEXT, month TEXT, value REAL, PRIMARY KEY (url, month))")
+        connection.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, fetched_at REAL, last_period INTEGER)")
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return 0
+
+        rows = connection.execute("SELECT url, month, value FROM prices").fetchall()
+        if len(rows) > 0:
+            print(f"Migrating {len(rows)} prices of '{path}' to schema version {SCHEMA_VERSION}...")
+        connection.execute("DROP TABLE prices")
+        connection.execute("CREATE TABLE prices (url TEXT, month TEXT, value REAL, PRIMARY KEY (url, month))")
+        connection.executemany("INSERT INTO prices VALUES (?, ?, ?)", [(url, month, to_price(value)) for url, month, value in rows])
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return len(rows)
+
+    def merge(self, path:str):
+        """
+        Adds the rows of another store file to this one: the prices missing here are inserted and every page keeps
+        its most recent download. Must be called holding the lock.
+        path: SQLite file of the other store. It is converted to the current schema first, if needed.
+        """
+        other = sqlite3.connect(path)
+        with other:
+            self.create(other, path)
+        other.close()
+
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            with self.connection:
+                self.connection.execute("INSERT OR IGNORE INTO prices SELECT url, month, value FROM other.prices")
+                self.connection.execute("INSERT INTO pages SELECT url, fetched_at, last_period FROM other.pages WHERE true "
+                                        "ON CONFLICT (url) DO UPDATE SET fetched_at = excluded.fetched_at, last_period = excluded.last_period "
+                                        "WHERE excluded.fetched_at > pages.fetched_at")
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+
+    def get_etag(self) -> Union[str,None]:
+        """
+        ETag of the last shared version merged into or uploaded from the local file.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'etag'").fetchone()
+        return row[0] if row is not None else None
+
+    def set_etag(self, etag:str):
+        """
+        Must be called holding the lock.
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('etag', ?)", (etag,))
+
+    def pull(self) -> Union[str,None]:
+        """
+        Downloads the shared file and merges it into the local store. Nothing is downloaded when the shared file is
+        still the version last merged or uploaded, so reopening a local store only costs a conditional request.
+        Returns the ETag of the shared file, or None if it doesn't exist yet.
+        """
+        known = self.get_etag()
+        fd, tmp_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            etag = self.s3.fetch_file(self.key, tmp_path, if_none_match=known)
+            if etag is not None and etag != known:
+                with self.lock:
+                    self.merge(tmp_path)
+                    self.set_etag(etag)
+            return etag
+        finally:
+            os.remove(tmp_path)
+
+    def put(self, url:str, table:dict):
+        """
+        Stores the whole price history of a page.
+        url: model page url.
+        table: {month: value} as parsed from the page (eg: {'janeiro 2024': 41024.0}). An empty table stores
+            the page as having no price at all.
+        """
+        periods = [period(i) for i in table]
+        periods = [i for i in periods if i is not None]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?)",
+                                        [(url, month.lower(), float(value)) for month, value in table.items()])
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                                    (url, time.time(), max(periods) if len(periods) > 0 else None))
+            self.changed = True
+
+    def lookup(self, urls:list, month:str) -> list:
+        """
+        Cached answer of a month for every url: the price, NOT_FOUND, or None when the page must be downloaded.
+        urls: model page urls.
+        month: reference month (eg: 'janeiro 2024').
+        """
+        month = month.lower()
+        this_period = period(month)
+        prices, pages = {}, {}
+        with self.lock:
+            # SQLite limits the number of parameters of a query, so long lists are looked up in chunks.
+            for start in range(0, len(urls), self.chunk_size):
+                chunk = list(urls[start:start + self.chunk_size])
+                placeholders = ', '.join(['?']*len(chunk))
+                prices.update(self.connection.execute(f"SELECT url, value FROM prices WHERE month = ? AND url IN ({placeholders})",
+                                                      [month] + chunk).fetchall())
+                pages.update({i[0]: i[1:] for i in self.connection.execute(f"SELECT url, fetched_at, last_period FROM pages WHERE url IN ({placeholders})",
+                                                                           chunk).fetchall()})
+
+        now = time.time()
+        answers = []
+        for url in urls:
+            if url in prices:
+                answers.append(prices[url])
+            elif url not in pages:
+                answers.append(None)
+            else:
+                fetched_at, last_period = pages[url]
+                published = last_period is not None and this_period is not None and this_period <= last_period
+                answers.append(NOT_FOUND if published or now - fetched_at < self.negative_ttl else None)
+        return answers
+
+    def sync(self, retries:int=5):
+        """
+        Uploads the store to S3, if it is shared and something was stored since the last upload. The shared file is
+        merged into the local one first, and the upload only replaces the version that was merged (If-Match on its
+        ETag). When another process uploaded in between, the merge is done again, so no process loses the rows of
+        the others.
+        retries: number of merges tried again after a conflicting upload.
+        """
+        if self.s3 is None or self.key is None or not self.changed or time.time() - self.synced_at < self.sync_interval:
+            return
+        for attempt in range(retries + 1):
+            etag = self.pull()
+            with self.lock:
+                self.connection.commit()
+                try:
+                    if etag is None:
+                        etag = self.s3.put_file(self.path, self.key, if_none_match='*')
+                    else:
+                        etag = self.s3.put_file(self.path, self.key, if_match=etag)
+                    self.set_etag(etag)
+                    self.changed = False
+                    self.synced_at = time.time()
+                    return
+                except botocore.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict') or attempt == retries:
+                        raise
+            print(f"'{self.key}' was updated by another process, merging it again...")
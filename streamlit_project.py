@@ -1,52 +1,42 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+import os, threading, time
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 from S3Work import S3Facilities
+from consolidation import Consolidator
+from cube import summarize
+from time_window import TimeWindow
 from fipe_brasil_sitemap import FipeScraper
+from fipe_jobs import FipeJobs
+from fipe_snapshot import FipeSnapshot, PRICES_KEY
+from price_store import PriceStore
 from datetime import date, timedelta
 
 def get_ranking(df:pd.DataFrame, selected_locadora:str):
-    this_df = pd.DataFrame()
-    this_grouped = df.groupby('Model Info')
-
-    this_df['Sales'] = this_grouped['Price'].count()
-
-    df['Price'] = [float(i.replace('R$ ', '').replace('.', '')) for i in df['Price']]
-    this_df['Median Prices'] = this_grouped['Price'].median()
-
-    this_df['Last Prices'] = this_grouped['Price'].last()
-
-    ranking = this_df.sort_values('Sales', ascending=False)
+    ranking = summarize(df).sort_values('Sales', ascending=False)
     ranking.reset_index(inplace=True)
 
     if selected_locadora == 'Localiza':
-        subset = ['Model Info', 'Brand', 'Model', 'Year']
+        subset = ['Model ID', 'Brand', 'Model', 'Year']
     else:
-        subset = ['Model Info', 'Brand', 'Model', 'Specification', 'Year']
+        subset = ['Model ID', 'Brand', 'Model', 'Specification', 'Year']
 
-    ranking = pd.merge(ranking, df[subset].drop_duplicates(), how='left', on='Model Info')
+    ranking = pd.merge(ranking, df[subset].drop_duplicates('Model ID'), how='left', on='Model ID')
+    ranking['Model Info'] = ranking['Model Info'].astype(str)
 
     ranking['Posição'] = [f"{i}°" for i in range(1, len(ranking) + 1)]
 
     return ranking[:25]
 
 
-def extract_timeseries_infos(entire_df, ranking):
-    entire_df = entire_df.groupby('Model Info')
+def extract_timeseries_infos(cube, ranking):
+    cube = cube[cube['Model ID'].isin(ranking['Model ID'])]
 
-    final_df = pd.DataFrame()
-    for group_name, df in entire_df:
-        if group_name in ranking.values:
-            this_df = pd.DataFrame()
-
-            grouped = df.groupby(df.index)
-            this_df['Median Price'] = grouped['Price'].median()
-            this_df['Sales'] = grouped['Model Info'].count()
-            this_df['Car Model'] = [group_name]*len(this_df)
-            final_df = pd.concat([final_df, this_df])
-
-    final_df.reset_index(inplace=True)
-    final_df.rename(columns={'index':'Date'}, inplace=True)
+    final_df = pd.DataFrame({'Date': cube.index,
+                             'Median Price': cube['Median Price'].values,
+                             'Sales': cube['Sales'].values,
+                             'Car Model': cube['Model Info'].astype(str).values})
 
     return final_df
 
@@ -67,20 +57,86 @@ def dataframe_with_selections(df):
     selected_rows = edited_df[edited_df.Select]
     return selected_rows.drop('Select', axis=1)
 
-@st.cache_data
-def update_data(listed_files, locadora):
-    filenames = [i for i in listed_files if locadora in i]
-
-    actual_df = s3.get_object(f'used-cars-for-sale/full_data/{locadora}/{locadora}.csv', index_col=0)
-    for fn in filenames:
-        this_date = fn.split('/')[-1].split('.')[0]
-        if this_date not in actual_df.index:
-            this_df = pd.DataFrame(s3.get_object(fn))
-            this_df.index = [this_date]*len(this_df)
-            actual_df = pd.concat([actual_df, this_df])
-    s3.put_file(actual_df, f'used-cars-for-sale/full_data/{locadora}/{locadora}.csv')
-
-    return actual_df
+@st.cache_resource
+def get_s3():
+    return S3Facilities('alternative-market-data', 'us-east-1', cache_dir='/tmp/s3-cache')
+
+# The FIPE prices already scraped are shared by every session and kept in S3 between deploys, merged with the
+# ones of fipe_snapshot at most every 10 minutes.
+# The scraper is rebuilt daily so its sitemap index is revalidated.
+@st.cache_resource(ttl=24*3600)
+def get_scraper():
+    store = PriceStore('/tmp/fipe_prices_dashboard.sqlite', s3=get_s3(), key=PRICES_KEY, sync_interval=600)
+    return FipeScraper(store=store)
+
+# FIPE searches run in a background worker shared by every session, so identical searches are only done once
+# and a search keeps running through the reruns of the sessions waiting for it.
+@st.cache_resource(ttl=24*3600)
+def get_jobs():
+    return FipeJobs(get_scraper())
+
+# Months crawled by fipe_snapshot are compared with a local join, the others (and the rows without a value in
+# the snapshot) fall back to the FIPE jobs.
+@st.cache_resource(ttl=3600, max_entries=4)
+def get_snapshot(ano, mes):
+    snapshot = FipeSnapshot(get_s3()).load(ano, mes)
+    return FipeSnapshot.prepare(snapshot) if snapshot is not None else None
+
+LOCADORAS = ['Localiza', 'Movida', 'Unidas']
+
+@st.cache_resource
+def get_publish_lock(locadora):
+    return threading.Lock()
+
+# Ingestion is the only step with side effects. It runs at most once every 10 minutes per company
+# and returns the latest ingested date, which is the key of the read cache below.
+# Sessions and the prefetch thread can miss the cache at the same time, so the ingests of a company are
+# serialized by a lock shared by the whole process: the second one finds nothing new in the manifest.
+@st.cache_data(ttl=600)
+def publish_data(locadora):
+    with get_publish_lock(locadora):
+        consolidator = Consolidator(s3, locadora)
+        consolidator.ingest(consolidator.list_new_files())
+
+        return consolidator.latest_date()
+
+# Shared by every session of the process, so the returned frames must not be modified.
+@st.cache_resource(ttl=3600, max_entries=6)
+def read_data(locadora, latest_date):
+    cube = Consolidator(s3, locadora).load_cube()
+    cube.index = pd.to_datetime(cube.index)
+
+    return cube, TimeWindow(cube.index)
+
+def load_company(locadora):
+    return read_data(locadora.lower(), publish_data(locadora.lower()))
+
+# The ranking of a window only changes with new data, so it is summarized once per company, latest date and window
+# instead of on every rerun of the page (eg: each click on the ranking checkboxes).
+@st.cache_data(ttl=3600, max_entries=64)
+def get_window_ranking(locadora, latest_date, initial_year, initial_month, final_year, final_month):
+    cube, window = read_data(locadora.lower(), latest_date)
+    return get_ranking(window.slice(cube, initial_year, initial_month, final_year, final_month), locadora)
+
+# Prefetching keeps every company in memory, so it's off unless the deploy sets DASHBOARD_PREFETCH=1 and has the
+# memory for it.
+PREFETCH = os.environ.get('DASHBOARD_PREFETCH') == '1'
+
+# Cached without arguments, so a single prefetch thread is started per process whatever the selected company.
+@st.cache_resource
+def start_prefetch():
+    '''
+    Loads the data of every company in a background thread, once per process. Companies already loaded by a
+    session are cache hits.
+    '''
+    def prefetch():
+        for locadora in LOCADORAS:
+            load_company(locadora)
+
+    thread = threading.Thread(target=prefetch, daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+    return thread
 
 if __name__ == "__main__":
     st.set_page_config(
@@ -92,79 +148,43 @@ if __name__ == "__main__":
     alt.themes.enable("dark")
 
 
-    s3 = S3Facilities('alternative-market-data', 'us-east-1')
-    listed_files = s3.list_files('used-cars-for-sale/full_data', endswith='.json')
-
-    localiza_df = update_data(listed_files, 'localiza')
-    movida_df = update_data(listed_files, 'movida')
-    unidas_df = update_data(listed_files, 'unidas')
-
-    localiza_df.index = pd.to_datetime(localiza_df.index)
-    movida_df.index = pd.to_datetime(movida_df.index)
-    unidas_df.index = pd.to_datetime(unidas_df.index)
-
-    locadoras_and_data = {'Localiza':localiza_df,
-                        'Movida':movida_df,
-                        'Unidas':unidas_df}
+    s3 = get_s3()
 
     with st.sidebar:
         st.title('🚗 Car Prices Dashboard')
 
-        locadoras = ['Localiza', 'Movida', 'Unidas']
-        selected_locadora = st.selectbox('Selecione uma Locadora', locadoras, index=len(locadoras)-1)
+        selected_locadora = st.selectbox('Selecione uma Locadora', LOCADORAS, index=len(LOCADORAS)-1)
 
-        this_df = locadoras_and_data[selected_locadora]
+        this_df, this_window = load_company(selected_locadora)
+        if PREFETCH:
+            start_prefetch()
 
         sidebar_col = st.columns((1, 1), gap='small')
 
         with sidebar_col[0]:
-            years_list = sorted(this_df.index.year.unique())
+            years_list = this_window.years()
             initial_selected_year = st.selectbox('Ano de início', years_list, index=0)
             final_selected_year = st.selectbox('Ano final', years_list, index=len(years_list)-1)
         
         with sidebar_col[1]:
-            initial_months_list = sorted(this_df[this_df.index.year == initial_selected_year].index.month.unique())
-            final_months_list = sorted(this_df[this_df.index.year == final_selected_year].index.month.unique())
+            initial_months_list = this_window.months(initial_selected_year)
+            final_months_list = this_window.months(final_selected_year)
             initial_selected_month = st.selectbox('Mês de início', initial_months_list, index=0)
             final_selected_month = st.selectbox('Mês final', final_months_list, index=len(final_months_list)-1)
         
-        initial_day = 1
-        final_day = 31
-
-        while True:
-            try:
-                first_loc = this_df.index.get_loc(pd.to_datetime(f'{initial_selected_year}-{initial_selected_month:02d}-{initial_day:02d}'))
-                if not isinstance(first_loc, int):
-                    first_loc = first_loc.start
-                break
-            except:
-                initial_day += 1
-
-        while True:
-            try:
-                final_loc = this_df.index.get_loc(pd.to_datetime(f'{final_selected_year}-{final_selected_month:02d}-{final_day:02d}'))
-                if not isinstance(final_loc, int):
-                    final_loc = final_loc.stop + 1
-                break
-            except:
-                final_day -= 1
-
-        df_selected = this_df.iloc[first_loc:final_loc]
-
-        if selected_locadora == 'Localiza':
-            df_selected['Model Info'] = df_selected['Brand'] + ' ' + df_selected['Model'] + ' ' + df_selected['Year']
-        else:
-            df_selected['Model Info'] = df_selected['Brand'] + ' ' + df_selected['Model'] + ' ' + df_selected['Specification'] + ' ' + df_selected['Year']
+        df_selected = this_window.slice(this_df, initial_selected_year, initial_selected_month, final_selected_year, final_selected_month)
 
 
         # df_selected = df_selected[['Model Info', 'Price']]
 
+    fipe_pending = False
     col = st.columns((1, 1), gap='medium')  
 
     with col[0]:
         st.markdown('#### Ranking')
-        this_ranking = get_ranking(df_selected, selected_locadora)
-        selection = dataframe_with_selections(this_ranking)['Model Info']
+        this_ranking = get_window_ranking(selected_locadora, publish_data(selected_locadora.lower()), initial_selected_year,
+                                          initial_selected_month, final_selected_year, final_selected_month)
+        selection = dataframe_with_selections(this_ranking)['Model ID']
 
         if not selection.empty:
             this_cols = st.columns(2, gap='small')
@@ -173,9 +193,28 @@ if __name__ == "__main__":
             with this_cols[1]:
                 response = st.button('Search')
 
+            search = (selected_locadora, initial_selected_year, initial_selected_month, tuple(selection))
             if response:
-                scraper = FipeScraper()
-                fipe_df = scraper.search_price(this_ranking[this_ranking['Model Info'].isin(selection)], initial_selected_year, initial_selected_month, selected_locadora)
+                st.session_state['fipe_search'] = search
+
+            # The search is kept in the session until the selection changes. Jobs are submitted again on every
+            # rerun, which is free for the ones already queued or done, and the table is refreshed while some are pending.
+            if st.session_state.get('fipe_search') == search:
+                fipe_rows = this_ranking[this_ranking['Model ID'].isin(selection)]
+                snapshot = get_snapshot(initial_selected_year, initial_selected_month)
+                if snapshot is not None:
+                    prices = FipeSnapshot.search_rows(fipe_rows, selected_locadora, *snapshot)
+                else:
+                    prices = [None]*len(fipe_rows)
+                # Rows without a value in the snapshot are searched by the FIPE jobs.
+                missing = [i for i, price in enumerate(prices) if price is None]
+                if len(missing) > 0:
+                    jobs = get_jobs()
+                    keys = jobs.submit(fipe_rows.iloc[missing], initial_selected_year, initial_selected_month, selected_locadora)
+                    for i, result in zip(missing, jobs.results(keys)):
+                        prices[i] = result
+                    fipe_pending = jobs.pending(keys) > 0
+                fipe_df = FipeScraper.price_table(fipe_rows, prices, selected_locadora)
                 if not fipe_df.empty:
                     st.dataframe(fipe_df, hide_index=True, use_container_width=True)
                 else:
@@ -183,7 +222,7 @@ if __name__ == "__main__":
 
     with col[1]:
         if not selection.empty:
-            time_series = extract_timeseries_infos(df_selected[df_selected['Model Info'].isin(selection)], this_ranking)
+            time_series = extract_timeseries_infos(df_selected[df_selected['Model ID'].isin(selection)], this_ranking)
             st.markdown('#### Median Price')
             st.altair_chart(alt.Chart(time_series).mark_line().encode(
                 x='Date:T',
@@ -198,15 +237,7 @@ if __name__ == "__main__":
             ), use_container_width=True)
 
     if not selection.empty:
-        full_ts = this_df.copy()
-        if selected_locadora == 'Localiza':
-            full_ts['Model Info'] = full_ts['Brand'] + ' ' + full_ts['Model'] + ' ' + full_ts['Year']
-        else:
-            full_ts['Model Info'] = full_ts['Brand'] + ' ' + full_ts['Model'] + ' ' + full_ts['Specification'] + ' ' + full_ts['Year']
-
-        full_ts['Price'] = [float(i.replace('R$ ', '').replace('.', '')) for i in full_ts['Price']]
-
-        full_time_series = extract_timeseries_infos(full_ts[full_ts['Model Info'].isin(selection)], this_ranking)
+        full_time_series = extract_timeseries_infos(this_df[this_df['Model ID'].isin(selection)], this_ranking)
         st.markdown('## Historical series')
         st.markdown('#### Median Price')
         st.altair_chart(alt.Chart(full_time_series).mark_line().encode(
@@ -219,4 +250,9 @@ if __name__ == "__main__":
             x='Date:T',
             y=alt.Y('Sales:Q', scale=alt.Scale(domain=[min(full_time_series['Sales']), max(full_time_series['Sales'])])),
             color='Car Model:N'
-        ), use_container_width=True)
\ No newline at end of file
+        ), use_container_width=True)
+
+    # The page is rerun every second while FIPE jobs of this session are pending, showing the rows already found.
+    if fipe_pending:
+        time.sleep(1)
+        st.rerun()
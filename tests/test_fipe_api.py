@@ -0,0 +1,138 @@
+import os, sys, json, threading
+import http.server
+from urllib.parse import parse_qsl
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fipe_api import FipeApiClient
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'fipe_api_responses.json')
+
+with open(FIXTURE, 'r', encoding='utf-8') as f:
+    RESPONSES = json.load(f)
+
+def recorded_response(endpoint:str, form:dict):
+    """
+    Recorded answer of an api/veiculos endpoint for the posted form, or None when there's no recording for it.
+    """
+    if endpoint == 'ConsultarTabelaDeReferencia':
+        return RESPONSES[endpoint]
+    if endpoint == 'ConsultarMarcas':
+        return RESPONSES[endpoint].get(form.get('codigoTabelaReferencia'))
+    if endpoint == 'ConsultarModelos':
+        return RESPONSES[endpoint].get(form.get('codigoMarca'))
+    if endpoint == 'ConsultarAnoModelo':
+        return RESPONSES[endpoint].get(form.get('codigoModelo'))
+    if endpoint == 'ConsultarValorComTodosParametros':
+        key = '-'.join([form.get(i, '') for i in ['codigoTabelaReferencia', 'codigoModelo', 'anoModelo', 'codigoTipoCombustivel']])
+        return RESPONSES[endpoint].get(key)
+    return None
+
+class FakeFipeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        form = dict(parse_qsl(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')))
+        endpoint = self.path.rstrip('/').split('/')[-1]
+        self.server.calls.append((endpoint, form))
+
+        data = recorded_response(endpoint, form) if self.path.startswith('/api/veiculos/') else None
+        if data is None:
+            data = {'codigo': '0', 'erro': 'Parâmetros inválidos'}
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def fake_fipe():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeFipeHandler)
+    server.calls = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(fake_fipe):
+    return FipeApiClient(url=f"http://127.0.0.1:{fake_fipe.server_port}", timeout=5, max_workers=2)
+
+@pytest.fixture
+def df_selected():
+    return pd.DataFrame({'Model Info': ['VW Gol 2020/2021', 'Fiat Uno Mille 2019/2019', 'VW Polo 2020/2020'],
+                         'Brand': ['VW', 'Fiat', 'VW'],
+                         'Model': ['Gol 1.0', 'Uno Mille 1.0', 'Polo 1.6'],
+                         'Year': ['2020/2021', '2019/2019', '2020/2020']})
+
+def test_reference_table(client):
+    assert client.get_tabela(5, 2024) == 308
+    assert client.get_tabela(6, 2024) == 309
+    with pytest.raises(ValueError):
+        client.get_tabela(1, 2010)
+
+def test_brand_model_and_year_selection(client):
+    assert client.get_marca(308, 'VW') == '59'
+    assert client.get_marca(308, 'Fiat') == '21'
+    assert client.get_modelo(308, '59', 'Gol 1.0') == (5940, 'Gol 1.0')
+    # Diesel years are skipped, as in the browser scraper.
+    assert client.get_ano(308, '59', 5940, '2020') == ('2020', '1')
+
+def test_search_row(client):
+    row = pd.Series({'Model Info': 'VW Gol 2020/2021', 'Brand': 'VW', 'Model': 'Gol 1.0', 'Year': '2020/2021'})
+    price = client.search_row(row, 6, 2024)
+    assert price.to_dict() == {'Gol 1.0': 'R$ 48.900,00'}
+
+def test_search_price(client, df_selected, fake_fipe):
+    fipe_df = client.search_price(df_selected, 5, 2024)
+
+    assert list(fipe_df.columns) == list(df_selected['Model Info'])
+    assert fipe_df.loc['Gol 1.0', 'VW Gol 2020/2021'] == 'R$ 48.200,00'
+    assert fipe_df.loc['Uno Mille 1.0', 'Fiat Uno Mille 2019/2019'] == 'R$ 31.500,00'
+    assert fipe_df.loc['Polo 1.6', 'VW Polo 2020/2020'] == 'R$ 71.900,00'
+    assert pd.isna(fipe_df.loc['Polo 1.6', 'VW Gol 2020/2021'])
+
+    endpoints = [i[0] for i in fake_fipe.calls]
+    for endpoint in ['ConsultarTabelaDeReferencia', 'ConsultarMarcas', 'ConsultarModelos', 'ConsultarAnoModelo', 'ConsultarValorComTodosParametros']:
+        assert endpoint in endpoints
+    assert endpoints.count('ConsultarValorComTodosParametros') == 3
+
+    value_form = [i[1] for i in fake_fipe.calls if i[0] == 'ConsultarValorComTodosParametros' and i[1]['codigoModelo'] == '5940'][0]
+    assert value_form['codigoTabelaReferencia'] == '308'
+    assert value_form['codigoMarca'] == '59'
+    assert value_form['tipoVeiculo'] == 'carro'
+    assert value_form['tipoConsulta'] == 'tradicional'
+
+def test_lookup_lists_are_cached(client, df_selected, fake_fipe):
+    client.search_price(df_selected, 5, 2024)
+    calls = len(fake_fipe.calls)
+    client.search_price(df_selected, 5, 2024)
+    # Only the values are asked again.
+    assert [i[0] for i in fake_fipe.calls[calls:]] == ['ConsultarValorComTodosParametros']*3
+
+def test_api_error(client):
+    row = pd.Series({'Model Info': 'Fiat Uno Mille 2018/2018', 'Brand': 'Fiat', 'Model': 'Uno Mille 1.0', 'Year': '2018/2018'})
+    with pytest.raises(ValueError):
+        client.search_row(row, 5, 2024)
+
+def test_engine_selected_per_call(client, df_selected, fake_fipe):
+    pytest.importorskip('selenium')
+    import fipe
+
+    scraper = fipe.FipeScraper(api=client)
+    fipe_df = scraper.search_price(df_selected, 5, 2024, engine='api')
+    assert fipe_df.equals(client.search_price(df_selected, 5, 2024))
+    # The browser pool was never used by the api engine.
+    assert scraper.pool.alive == 0
+
+    with pytest.raises(ValueError):
+        scraper.search_price(df_selected, 5, 2024, engine='unknown')
@@ -0,0 +1,48 @@
+import pandas as pd
+
+class TimeWindow(object):
+    def __init__(self, index:pd.DatetimeIndex):
+        """
+        Month based window selection over a sorted DatetimeIndex. The first and last positions of every month are
+        found once with searchsorted, so picking the available years/months and slicing a window are dictionary lookups.
+        index: sorted DatetimeIndex of the frame that is going to be sliced.
+        """
+        if not index.is_monotonic_increasing:
+            raise ValueError("The index must be sorted.")
+        self.index = index
+
+        months = index.to_period('M').unique()
+        starts = index.searchsorted(months.to_timestamp(), side='left')
+        stops = index.searchsorted((months + 1).to_timestamp(), side='left')
+        self.offsets = {(i.year, i.month): (int(start), int(stop)) for i, start, stop in zip(months, starts, stops)}
+
+    def years(self) -> list:
+        return sorted(set([i[0] for i in self.offsets]))
+
+    def months(self, year:int) -> list:
+        return sorted([i[1] for i in self.offsets if i[0] == year])
+
+    def bounds(self, initial_year:int, initial_month:int, final_year:int, final_month:int) -> tuple:
+        """
+        Positions (first, stop) of the rows from the first day of the initial month to the last day of the final month,
+        ready to be used as frame.iloc[first:stop]. Months without data are located with searchsorted.
+        """
+        if (initial_year, initial_month) in self.offsets:
+            first = self.offsets[(initial_year, initial_month)][0]
+        else:
+            first = int(self.index.searchsorted(pd.Timestamp(year=initial_year, month=initial_month, day=1), side='left'))
+
+        if (final_year, final_month) in self.offsets:
+            stop = self.offsets[(final_year, final_month)][1]
+        else:
+            month_end = pd.Period(year=final_year, month=final_month, freq='M') + 1
+            stop = int(self.index.searchsorted(month_end.to_timestamp(), side='left'))
+
+        return first, max(first, stop)
+
+    def slice(self, df:pd.DataFrame, initial_year:int, initial_month:int, final_year:int, final_month:int) -> pd.DataFrame:
+        """
+        Rows of df (indexed by the same index given to the constructor) between the initial and final months, inclusive.
+        """
+        first, stop = self.bounds(initial_year, initial_month, final_year, final_month)
+        return df.iloc[first:stop]